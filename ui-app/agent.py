@@ -4,7 +4,7 @@ from dataclasses import dataclass, field
 import time, importlib, inspect, os, json
 from typing import Any, Optional, Dict, TypedDict
 import uuid
-from python.helpers import extract_tools, rate_limiter, files, errors
+from python.helpers import extract_tools, rate_limiter, files, errors, prompt_templates, tokens, history, prompt_cache
 from python.helpers.print_style import PrintStyle
 from langchain.schema import AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
@@ -42,6 +42,7 @@ class AgentContext:
         self.paused = paused
         self.streaming_agent = streaming_agent
         self.process: DeferredTask | None = None
+        self.prompt_cache = prompt_cache.PrefixStats()
         AgentContext._counter += 1
         self.no = AgentContext._counter
 
@@ -119,16 +120,37 @@ class AgentConfig:
     chat_model: BaseChatModel | BaseLLM
     utility_model: BaseChatModel | BaseLLM
     embeddings_model: Embeddings
+    # "" estimates, "tiktoken:<encoding or model>" or a path to a tokenizer.json file
+    chat_model_tokenizer: str = ""
+    utility_model_tokenizer: str = ""
     prompts_subdir: str = ""
+    prompt_layout: str = "classic"  # classic, or cached to keep the system prompt stable between calls
     memory_subdir: str = ""
     knowledge_subdirs: list[str] = field(default_factory=lambda: ["default", "custom"])
+    knowledge_import_workers: int = 0  # processes parsing knowledge files, 0 = up to 8 by cpu count
+    knowledge_watch: bool = True  # apply file changes in knowledge/ and instruments/ while running
+    memory_journal_max_ops: int = 500
+    memory_index_type: str = "flat"  # flat, hnsw, ivf_flat, ivf_pq, sq8, fp16
+    memory_index_params: dict[str, Any] = field(default_factory=dict)
+    memory_shared: bool = False  # several processes use the same memory dir
+    memory_dedup_threshold: float = 0  # skip inserts this similar to a stored memory, 0 = exact copies only
+    # per area, e.g. {"fragments": {"max_items": 5000, "max_age_days": 90, "evict": "lru"}}
+    memory_retention: dict[str, dict[str, Any]] = field(default_factory=dict)
+    memory_sweep_interval: int = 3600  # seconds between retention sweeps
+    memory_recall_token_budget: int = 1500  # per recalled prompt section, 0 = unlimited
+    memory_recall_mmr_lambda: float = 0.7  # relevance vs diversity of recalled memories, 1 = relevance only
+    embeddings_cache_max_mb: int = 1024  # 0 = unbounded
+    embeddings_query_cache_size: int = 1000  # 0 = off
+    embeddings_query_cache_persist: bool = False
     auto_memory_count: int = 3
     auto_memory_skip: int = 2
     rate_limit_seconds: int = 60
     rate_limit_requests: int = 15
     rate_limit_input_tokens: int = 0
     rate_limit_output_tokens: int = 0
-    msgs_keep_max: int = 25
+    history_soft_tokens: int = 4000  # a summary is prepared in the background above this
+    history_hard_tokens: int = 6000  # the next call waits for the summary above this
+    msgs_keep_max: int = 25  # deprecated and ignored, history is limited by the token settings above
     msgs_keep_start: int = 5
     msgs_keep_end: int = 10
     response_timeout_seconds: int = 60
@@ -150,6 +172,7 @@ class AgentConfig:
     code_exec_ssh_port: int = 50022
     code_exec_ssh_user: str = "root"
     code_exec_ssh_pass: str = "toor"
+    hot_reload: bool = False  # reload edited tools and extensions without restart, for development
     additional: Dict[str, Any] = field(default_factory=dict)
 
 
@@ -188,6 +211,7 @@ class LoopData:
     def __init__(self):
         self.iteration = -1
         self.system = []
+        self.volatile = []  # prompt parts changing between calls, like time and recalled memories
         self.message = ""
         self.history_from = 0
         self.history = []
@@ -233,6 +257,11 @@ class Agent:
             max_output_tokens=self.config.rate_limit_output_tokens,
             window_seconds=self.config.rate_limit_seconds,
         )
+        self.chat_tokens = tokens.TokenCounter(self.config.chat_model_tokenizer)
+        self.utility_tokens = tokens.TokenCounter(self.config.utility_model_tokenizer)
+        self.history_tokens = tokens.HistoryTokens(self.chat_tokens)
+        self.history_summary = history.Summary()
+        self._compaction: asyncio.Task | None = None
         self.data = {}  # free data object all the tools can use
 
     async def monologue(self, msg: str):
@@ -261,6 +290,8 @@ class Agent:
 
                         # set system prompt and message history
                         loop_data.system = []
+                        loop_data.volatile = []
+                        await self.limit_history()
                         loop_data.history = self.history
 
                         # and allow extensions to edit them
@@ -268,19 +299,34 @@ class Agent:
                             "message_loop_prompts", loop_data=loop_data
                         )
 
-                        # build chain from system prompt, message history and model
+                        # build chain from system prompt, message history and model,
+                        # the cached layout puts volatile parts after the history
+                        messages = loop_data.history
+                        if self.config.prompt_layout == prompt_cache.CACHED:
+                            system = "\n\n".join(loop_data.system)
+                            messages = prompt_cache.with_suffix(
+                                messages, "\n\n".join(loop_data.volatile)
+                            )
+                        else:
+                            system = "\n\n".join(loop_data.system + loop_data.volatile)
                         prompt = ChatPromptTemplate.from_messages(
                             [
-                                SystemMessage(content="\n\n".join(loop_data.system)),
+                                SystemMessage(content=system),
                                 MessagesPlaceholder(variable_name="messages"),
                             ]
                         )
                         chain = prompt | self.config.chat_model
 
                         # rate limiter TODO - move to extension, make per-model
-                        formatted_inputs = prompt.format(messages=self.history)
-                        tokens = int(len(formatted_inputs) / 4)
-                        self.rate_limiter.limit_call_and_input(tokens)
+                        input_tokens = self.chat_tokens.count(
+                            system
+                        ) + self.history_tokens.update(loop_data.history)
+                        if messages is not loop_data.history:
+                            input_tokens += self.chat_tokens.count(
+                                "\n\n".join(loop_data.volatile)
+                            )
+                        call = self.rate_limiter.limit_call_and_input(input_tokens)
+                        usage = (0, 0)
 
                         # output that the agent is starting
                         PrintStyle(
@@ -293,9 +339,13 @@ class Agent:
                             type="agent", heading=f"{self.agent_name}: Generating"
                         )
 
-                        async for chunk in chain.astream(
-                            {"messages": loop_data.history}
-                        ):
+                        prefix_hit = self.context.prompt_cache.start(
+                            self.number, system, messages
+                        )
+                        started = time.time()
+                        first_token = True
+
+                        async for chunk in chain.astream({"messages": messages}):
                             await self.handle_intervention(
                                 agent_response
                             )  # wait for intervention and handle it, if paused
@@ -306,8 +356,14 @@ class Agent:
                                 content = str(chunk.content)
                             else:
                                 content = str(chunk)
+                            usage = tuple(map(sum, zip(usage, tokens.usage_of(chunk))))  # type: ignore
 
                             if content:
+                                if first_token:
+                                    self.context.prompt_cache.first_token(
+                                        prefix_hit, time.time() - started
+                                    )
+                                    first_token = False
                                 printer.stream(
                                     content
                                 )  # output the agent response stream
@@ -316,9 +372,9 @@ class Agent:
                                 )
                                 self.log_from_stream(agent_response, log)
 
-                        self.rate_limiter.set_output_tokens(
-                            int(len(agent_response) / 4)
-                        )  # rough estimation
+                        self._record_usage(
+                            call, self.chat_tokens, input_tokens, usage, agent_response
+                        )
 
                         await self.handle_intervention(agent_response)
 
@@ -405,7 +461,7 @@ class Agent:
         ):  # if agent has custom folder, use it and use default as backup
             prompt_dir = files.get_abs_path("prompts", self.config.prompts_subdir)
             backup_dir.append(files.get_abs_path("prompts/default"))
-        return files.read_file(
+        return prompt_templates.render(
             files.get_abs_path(prompt_dir, file), backup_dirs=backup_dir, **kwargs
         )
 
@@ -422,11 +478,7 @@ class Agent:
         else:
             new_message = HumanMessage(content=msg) if human else AIMessage(content=msg)
             self.history.append(new_message)
-            await self.cleanup_history(
-                self.config.msgs_keep_max,
-                self.config.msgs_keep_start,
-                self.config.msgs_keep_end,
-            )
+        self.prepare_history_summary()
         if message_type == "ai":
             self.last_message = msg
 
@@ -434,7 +486,11 @@ class Agent:
         return "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
 
     async def call_utility_llm(
-        self, system: str, msg: str, callback: Callable[[str], None] | None = None
+        self,
+        system: str,
+        msg: str,
+        callback: Callable[[str], None] | None = None,
+        background: bool = False,  # leaves pausing and interventions to the message loop
     ):
         prompt = ChatPromptTemplate.from_messages(
             [SystemMessage(content=system), HumanMessage(content=msg)]
@@ -443,12 +499,13 @@ class Agent:
         chain = prompt | self.config.utility_model
         response = ""
 
-        formatted_inputs = prompt.format()
-        tokens = int(len(formatted_inputs) / 4)
-        self.rate_limiter.limit_call_and_input(tokens)
+        input_tokens = self.utility_tokens.count(system) + self.utility_tokens.count(msg)
+        call = self.rate_limiter.limit_call_and_input(input_tokens)
+        usage = (0, 0)
 
         async for chunk in chain.astream({}):
-            await self.handle_intervention()  # wait for intervention and handle it, if paused
+            if not background:
+                await self.handle_intervention()  # wait for intervention and handle it, if paused
 
             if isinstance(chunk, str):
                 content = chunk
@@ -456,21 +513,37 @@ class Agent:
                 content = str(chunk.content)
             else:
                 content = str(chunk)
+            usage = tuple(map(sum, zip(usage, tokens.usage_of(chunk))))  # type: ignore
 
             if callback:
                 callback(content)
 
             response += content
 
-        self.rate_limiter.set_output_tokens(int(len(response) / 4))
+        self._record_usage(call, self.utility_tokens, input_tokens, usage, response)
 
         return response
 
+    def _record_usage(
+        self,
+        call: rate_limiter.CallRecord,
+        counter: tokens.TokenCounter,
+        input_tokens: int,
+        usage: tuple[int, int],
+        response: str,
+    ):
+        # prefer what the provider reports over our counts
+        reported_input, reported_output = usage
+        if reported_input:
+            call.input_tokens = reported_input
+            counter.calibrate(input_tokens, reported_input)
+        call.output_tokens += reported_output or counter.count(response)
+
     def get_last_message(self):
         if self.history:
             return self.history[-1]
 
-    async def replace_middle_messages(self, middle_messages):
+    async def summarize_messages(self, text: str) -> str:
         cleanup_prompt = self.read_prompt("fw.msg_cleanup.md")
         log_item = self.context.log.log(
             type="util", heading="Mid messages cleanup summary"
@@ -485,39 +558,73 @@ class Agent:
             printer.print(content)
             log_item.stream(content=content)
 
-        summary = await self.call_utility_llm(
+        return await self.call_utility_llm(
             system=cleanup_prompt,
-            msg=self.concat_messages(middle_messages),
+            msg=text,
             callback=log_callback,
+            background=True,
         )
-        new_human_message = HumanMessage(content=summary)
-        return [new_human_message]
-
-    async def cleanup_history(self, max: int, keep_start: int, keep_end: int):
-        if len(self.history) <= max:
-            return self.history
 
-        first_x = self.history[:keep_start]
-        last_y = self.history[-keep_end:]
-
-        # Identify the middle part
-        middle_part = self.history[keep_start:-keep_end]
-
-        # Ensure the first message in the middle is "human", if not, move one message back
-        if middle_part and middle_part[0].type != "human":
-            if len(first_x) > 0:
-                middle_part.insert(0, first_x.pop())
-
-        # Ensure the middle part has an odd number of messages
-        if len(middle_part) % 2 == 0:
-            middle_part = middle_part[:-1]
-
-        # Replace the middle part using the replacement function
-        new_middle_part = await self.replace_middle_messages(middle_part)
-
-        self.history = first_x + new_middle_part + last_y
-
-        return self.history
+    def prepare_history_summary(self):
+        # summarise in the background once the history passes the soft limit
+        if self._compaction and not self._compaction.done():
+            return
+        if self.history_tokens.update(self.history) <= self.config.history_soft_tokens:
+            return
+        self._compaction = asyncio.create_task(self.compact_history())
+
+    async def limit_history(self):
+        # the history sent to the model must fit the hard limit
+        while self.history_tokens.update(self.history) > self.config.history_hard_tokens:
+            if self._compaction and not self._compaction.done():
+                await self._compaction
+            elif not await self.compact_history():
+                break  # nothing left to summarise
+
+    async def compact_history(self) -> bool:
+        """Summarise the oldest raw messages into the history summary.
+
+        The summary is prepared on a copy and swapped in at once, unless the
+        summarised messages changed in the meantime. Returns whether it was.
+        """
+        try:
+            span = history.compaction_range(
+                self.history,
+                self.history_summary,
+                self.config.msgs_keep_start,
+                self.config.msgs_keep_end,
+            )
+            if not span:
+                return False
+            start, end = span
+            messages = self.history[start:end]
+            lengths = [len(message.content) for message in messages]
+
+            summary = self.history_summary.copy()
+            summary.add(await self.summarize_messages(self.concat_messages(messages)))
+            while merge := summary.mergeable():
+                level, texts = merge
+                summary.merge(level, await self.summarize_messages("\n\n".join(texts)))
+
+            current = self.history[start:end]
+            if (
+                summary.message is not self.history_summary.message
+                or len(current) != len(messages)
+                or any(a is not b for a, b in zip(current, messages))
+                or [len(message.content) for message in current] != lengths
+            ):
+                return False
+            if summary.message is not None:
+                start -= 1  # replace the previous summary message too
+            summary.message = HumanMessage(content=summary.text())
+            self.history = self.history[:start] + [summary.message] + self.history[end:]
+            self.history_summary = summary
+            return True
+        except Exception as e:
+            PrintStyle(font_color="red", padding=True).print(
+                f"History summary failed: {errors.format_error(e)}"
+            )
+            return False
 
     async def handle_intervention(self, progress: str = ""):
         while self.context.paused:
@@ -582,8 +689,8 @@ class Agent:
         from python.tools.unknown import Unknown
         from python.helpers.tool import Tool
 
-        classes = extract_tools.load_classes_from_folder(
-            "python/tools", name + ".py", Tool
+        classes = extract_tools.cached_classes(
+            "python/tools", name + ".py", Tool, self.config.hot_reload
         )
         tool_class = classes[0] if classes else Unknown
         return tool_class(agent=self, name=name, args=args, message=message, **kwargs)
@@ -591,8 +698,8 @@ class Agent:
     async def call_extensions(self, folder: str, **kwargs) -> Any:
         from python.helpers.extension import Extension
 
-        classes = extract_tools.load_classes_from_folder(
-            "python/extensions/" + folder, "*", Extension
+        classes = extract_tools.cached_classes(
+            "python/extensions/" + folder, "*", Extension, self.config.hot_reload
         )
         for cls in classes:
             await cls(agent=self).execute(**kwargs)
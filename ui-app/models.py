@@ -16,12 +16,14 @@ def get_api_key(service):
 def get_ollama_chat(
         model_name:str, 
         temperature=DEFAULT_TEMPERATURE, 
-        base_url=os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434", num_ctx=8192
+        base_url=os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434", num_ctx=8192,
+        keep_alive=os.getenv("OLLAMA_KEEP_ALIVE") or "30m", # keeps the model and its prompt cache loaded between calls
     ):
     return ChatOllama(model=model_name,
             temperature=temperature,
             base_url=base_url,
             num_ctx=num_ctx,
+            keep_alive=keep_alive,
     )
 
 def get_ollama_embedding(
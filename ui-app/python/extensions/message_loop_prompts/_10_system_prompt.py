@@ -1,4 +1,5 @@
 from datetime import datetime
+from python.helpers import prompt_cache
 from python.helpers.extension import Extension
 from agent import Agent, LoopData
 
@@ -11,6 +12,10 @@ class SystemPrompt(Extension):
         tools = get_tools_prompt(self.agent)
         loop_data.system.append(main)
         loop_data.system.append(tools)
+        if self.agent.config.prompt_layout == prompt_cache.CACHED:
+            loop_data.volatile.append(
+                self.agent.read_prompt("agent.system.datetime.md", date_time=get_date_time())
+            )
 
 def get_main_prompt(agent: Agent):
     return get_prompt("agent.system.main.md", agent)
@@ -20,10 +25,16 @@ def get_tools_prompt(agent: Agent):
 
 def get_prompt(file: str, agent: Agent):
     # variables for system prompts
-    # TODO: move variables to the end of chain
-    # variables in system prompt would break prompt caching, better to add them to the last message in conversation
+    # with the cached layout the time is added after the conversation, it would change the prefix every call
     vars = {
-        "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "date_time": (
+            "given at the end of the conversation"
+            if agent.config.prompt_layout == prompt_cache.CACHED
+            else get_date_time()
+        ),
         "agent_name": agent.agent_name,
     }
     return agent.read_prompt(file, **vars)
+
+def get_date_time():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
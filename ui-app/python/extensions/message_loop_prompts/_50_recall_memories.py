@@ -50,12 +50,16 @@ class RecallMemories(Extension):
         # get solutions database
         db = await Memory.get(self.agent)
 
-        memories = await db.search_similarity_threshold(
-            query=query,
-            limit=RecallMemories.RESULTS,
-            threshold=RecallMemories.THRESHOLD,
-            filter=f"area == '{Memory.Area.MAIN.value}' or area == '{Memory.Area.FRAGMENTS.value}'",  # exclude solutions
-        )
+        # diverse results within the token budget
+        recall = (
+            await db.recall_many(
+                queries=[query],
+                limit=RecallMemories.RESULTS,
+                threshold=RecallMemories.THRESHOLD,
+                filter=f"area == '{Memory.Area.MAIN.value}' or area == '{Memory.Area.FRAGMENTS.value}'",  # exclude solutions
+            )
+        )[0]
+        memories = recall.docs
 
         # log the short result
         if not isinstance(memories, list) or len(memories) == 0:
@@ -66,6 +70,7 @@ class RecallMemories(Extension):
         else:
             log_item.update(
                 heading=f"{len(memories)} memories found",
+                tokens=f"{recall.tokens}, {recall.tokens_saved} saved",
             )
 
         # concatenate memory.page_content in memories:
@@ -82,5 +87,5 @@ class RecallMemories(Extension):
             "agent.system.memories.md", memories=memories_text
         )
 
-        # append to system message
-        loop_data.system.append(memories_prompt)
+        # append to the volatile part of the prompt, recalled memories change with the query
+        loop_data.volatile.append(memories_prompt)
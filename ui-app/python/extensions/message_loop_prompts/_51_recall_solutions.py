@@ -51,21 +51,22 @@ class RecallSolutions(Extension):
         # get solutions database
         db = await Memory.get(self.agent)
 
-        solutions = await db.search_similarity_threshold(
-            query=query,
-            limit=RecallSolutions.SOLUTIONS_COUNT,
+        # one embedding and one search batch for both areas, diverse results within the token budget
+        solutions_recall, instruments_recall = await db.recall_many(
+            queries=[query, query],
+            limit=[RecallSolutions.SOLUTIONS_COUNT, RecallSolutions.INSTRUMENTS_COUNT],
             threshold=RecallSolutions.THRESHOLD,
-            filter=f"area == '{Memory.Area.SOLUTIONS.value}'",
-        )
-        instruments = await db.search_similarity_threshold(
-            query=query,
-            limit=RecallSolutions.INSTRUMENTS_COUNT,
-            threshold=RecallSolutions.THRESHOLD,
-            filter=f"area == '{Memory.Area.INSTRUMENTS.value}'",
+            filter=[
+                f"area == '{Memory.Area.SOLUTIONS.value}'",
+                f"area == '{Memory.Area.INSTRUMENTS.value}'",
+            ],
         )
 
+        solutions, instruments = solutions_recall.docs, instruments_recall.docs
         log_item.update(
             heading=f"{len(instruments)} instruments, {len(solutions)} solutions found",
+            tokens=f"{solutions_recall.tokens + instruments_recall.tokens}, "
+            f"{solutions_recall.tokens_saved + instruments_recall.tokens_saved} saved",
         )
 
         if instruments:
@@ -77,7 +78,7 @@ class RecallSolutions(Extension):
             instruments_prompt = self.agent.read_prompt(
                 "agent.system.instruments.md", instruments=instruments_text
             )
-            loop_data.system.append(instruments_prompt)
+            loop_data.volatile.append(instruments_prompt)
 
         if solutions:
             solutions_text = ""
@@ -88,4 +89,4 @@ class RecallSolutions(Extension):
             solutions_prompt = self.agent.read_prompt(
                 "agent.system.solutions.md", solutions=solutions_text
             )
-            loop_data.system.append(solutions_prompt)
+            loop_data.volatile.append(solutions_prompt)
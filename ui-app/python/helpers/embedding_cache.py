@@ -0,0 +1,300 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+import numpy as np
+from langchain_core.stores import ByteStore
+
+
+class SqliteByteStore(ByteStore):
+    """Embedding cache in a single SQLite file, bounded by size with LRU eviction.
+
+    Replaces the one-file-per-text LocalFileStore. The database runs in WAL mode so
+    several processes can read while one writes. Every hit refreshes the access
+    time of the entry, and once the cache grows over `max_bytes` the least
+    recently used entries are dropped until it is back under `EVICT_TO` of it.
+    """
+
+    EVICT_TO = 0.9
+    BATCH = 500  # sqlite limits the number of bound parameters per statement
+
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes  # 0 = unbounded
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+        )
+        self._conn.commit()
+        self._size = self._total_size()
+
+    def mget(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        found: dict[str, bytes] = {}
+        with self._lock:
+            for batch in _batches(list(keys), SqliteByteStore.BATCH):
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({_marks(batch)})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE cache SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        if not key_value_pairs:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                [(key, value, len(key) + len(value), now) for key, value in key_value_pairs],
+            )
+            self._conn.commit()
+            self._size += sum(len(key) + len(value) for key, value in key_value_pairs)
+            if self.max_bytes and self._size > self.max_bytes:
+                self._evict()
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            for batch in _batches(list(keys), SqliteByteStore.BATCH):
+                self._conn.execute(
+                    f"DELETE FROM cache WHERE key IN ({_marks(batch)})", batch
+                )
+            self._conn.commit()
+            self._size = self._total_size()
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._lock:
+            if prefix:
+                rows = self._conn.execute(
+                    "SELECT key FROM cache WHERE substr(key, 1, ?) = ?",
+                    (len(prefix), prefix),
+                ).fetchall()
+            else:
+                rows = self._conn.execute("SELECT key FROM cache").fetchall()
+        for (key,) in rows:
+            yield key
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        # keep the most recently used entries that fit, other processes may have added more
+        keep = int(self.max_bytes * SqliteByteStore.EVICT_TO)
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM (SELECT key, SUM(size) OVER "
+            "(ORDER BY accessed DESC, key ROWS UNBOUNDED PRECEDING) AS total FROM cache) "
+            "WHERE total > ?)",
+            (keep,),
+        )
+        self._conn.commit()
+        self._size = self._total_size()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+
+# embedding kinds, models like e5 or nomic prefix queries and documents differently
+QUERY = "query"
+DOCUMENT = "document"
+
+
+class QueryCache:
+    """LRU of query embeddings keyed by model, embedding kind and text.
+
+    CacheBackedEmbeddings only caches documents, so every recall used to embed its
+    query again. With a `store` the entries are also written there and survive
+    restarts, the in-process LRU stays in front of it.
+    """
+
+    def __init__(self, max_items: int = 1000, store: ByteStore | None = None):
+        self.max_items = max_items
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[tuple[str, str, str], list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(
+        self, model: str, texts: list[str], kind: str = QUERY
+    ) -> list[list[float] | None]:
+        with self._lock:
+            found = [self._items.get((model, kind, text)) for text in texts]
+            for text, vector in zip(texts, found):
+                if vector is not None:
+                    self._items.move_to_end((model, kind, text))
+
+        missing = [text for text, vector in zip(texts, found) if vector is None]
+        if missing and self.store:
+            stored = dict(zip(missing, self.store.mget([_query_key(model, kind, t) for t in missing])))
+            loaded = {
+                text: np.frombuffer(data, dtype=np.float32).tolist()
+                for text, data in stored.items()
+                if data is not None
+            }
+            self._remember(model, kind, loaded)
+            found = [
+                vector if vector is not None else loaded.get(text)
+                for text, vector in zip(texts, found)
+            ]
+
+        with self._lock:
+            misses = sum(1 for vector in found if vector is None)
+            self.misses += misses
+            self.hits += len(found) - misses
+        return found
+
+    def put_many(
+        self, model: str, texts: list[str], vectors: list[list[float]], kind: str = QUERY
+    ):
+        self._remember(model, kind, dict(zip(texts, vectors)))
+        if self.store:
+            self.store.mset(
+                [
+                    (_query_key(model, kind, text), np.asarray(vector, dtype=np.float32).tobytes())
+                    for text, vector in zip(texts, vectors)
+                ]
+            )
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remember(self, model: str, kind: str, vectors: dict[str, list[float]]):
+        with self._lock:
+            for text, vector in vectors.items():
+                self._items[(model, kind, text)] = vector
+                self._items.move_to_end((model, kind, text))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+def _query_key(model: str, kind: str, text: str) -> str:
+    # "vector:" keys, the earlier "query:" ones could hold document embeddings of queries
+    return f"vector:{kind}:{model}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+
+_stores: dict[str, SqliteByteStore] = {}
+_stores_lock = threading.Lock()
+_query_cache: QueryCache | None = None
+
+
+def open_store(path: str, max_bytes: int = 0) -> SqliteByteStore:
+    """One store per cache file in this process, shared by all memory subdirs."""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SqliteByteStore(path, max_bytes)
+        store.max_bytes = max_bytes
+        return store
+
+
+def query_cache(max_items: int, store: ByteStore | None = None) -> QueryCache:
+    """The query cache of this process, keyed by model so memory subdirs can share it."""
+    global _query_cache
+    with _stores_lock:
+        if _query_cache is None:
+            _query_cache = QueryCache(max_items, store)
+        _query_cache.max_items = max_items
+        _query_cache.store = store
+        return _query_cache
+
+
+def migrate_from_dir(
+    store: ByteStore,
+    em_dir: str,
+    remove: bool = True,
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    """Copy a LocalFileStore cache directory into `store`.
+
+    Keys are the paths relative to `em_dir`, like LocalFileStore uses them. Files are
+    removed once their batch is stored, so an interrupted migration resumes where it
+    stopped. Returns the number of migrated entries.
+    """
+    count = 0
+    batch: list[tuple[str, str]] = []
+
+    def flush():
+        nonlocal count
+        store.mset([(key, _read(path)) for key, path in batch])
+        if remove:
+            for _, path in batch:
+                os.remove(path)
+        count += len(batch)
+        batch.clear()
+        if progress:
+            progress(count)
+
+    for root, _, names in os.walk(em_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            batch.append((os.path.relpath(path, em_dir).replace(os.sep, "/"), path))
+            if len(batch) >= SqliteByteStore.BATCH:
+                flush()
+    if batch:
+        flush()
+
+    if remove:
+        # drop the emptied directory tree, model namespaces may contain slashes
+        for root, _, _ in sorted(os.walk(em_dir), key=lambda w: -len(w[0])):
+            if not os.listdir(root):
+                os.rmdir(root)
+    return count
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _marks(batch: list[str]) -> str:
+    return ", ".join("?" * len(batch))
+
+
+def _batches(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+if __name__ == "__main__":
+    # python -m python.helpers.embedding_cache <embeddings dir> <cache file>
+    import sys
+
+    source, target = sys.argv[1], sys.argv[2]
+    migrated = migrate_from_dir(
+        SqliteByteStore(target),
+        source,
+        progress=lambda n: print(f"\rMigrated {n} embeddings", end=""),
+    )
+    print(f"\rMigrated {migrated} embeddings to {target}")
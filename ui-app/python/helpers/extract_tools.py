@@ -51,7 +51,7 @@ def fix_json_string(json_string):
 
 T = TypeVar('T')  # Define a generic type variable
 
-def load_classes_from_folder(folder: str, name_pattern: str, base_class: Type[T]) -> list[Type[T]]:
+def load_classes_from_folder(folder: str, name_pattern: str, base_class: Type[T], reload: bool = False) -> list[Type[T]]:
     import os
     import importlib
     import inspect
@@ -61,15 +61,15 @@ def load_classes_from_folder(folder: str, name_pattern: str, base_class: Type[T]
     abs_folder = get_abs_path(folder)
 
     # Get all .py files in the folder that match the pattern, sorted alphabetically
-    py_files = sorted(
-        [file_name for file_name in os.listdir(abs_folder) if fnmatch(file_name, name_pattern) and file_name.endswith(".py")]
-    )
+    py_files = _matching_files(abs_folder, name_pattern)
 
     # Iterate through the sorted list of files
     for file_name in py_files:
         module_name = file_name[:-3]  # remove .py extension
         module_path = folder.replace("/", ".") + "." + module_name
         module = importlib.import_module(module_path)
+        if reload:
+            module = importlib.reload(module)
 
         # Get all classes in the module
         class_list = inspect.getmembers(module, inspect.isclass)
@@ -80,3 +80,37 @@ def load_classes_from_folder(folder: str, name_pattern: str, base_class: Type[T]
                 classes.append(cls[1])
 
     return classes
+
+
+def _matching_files(abs_folder: str, name_pattern: str) -> list[str]:
+    if not os.path.isdir(abs_folder):
+        return []
+    return sorted(
+        [file_name for file_name in os.listdir(abs_folder) if fnmatch(file_name, name_pattern) and file_name.endswith(".py")]
+    )
+
+
+# (folder, pattern, base class) -> (file modification times, classes)
+_class_cache: dict[tuple[str, str, type], tuple[dict[str, int], list[type]]] = {}
+
+def cached_classes(folder: str, name_pattern: str, base_class: Type[T], hot_reload: bool = False) -> list[Type[T]]:
+    """`load_classes_from_folder` imported once per folder and pattern.
+
+    With `hot_reload` the folder is listed on every call and modules are
+    reloaded when files were added, removed or modified, meant for development.
+    """
+    key = (folder, name_pattern, base_class)
+    cached = _class_cache.get(key)
+    if cached and not hot_reload:
+        return cached[1]  # type: ignore
+
+    abs_folder = get_abs_path(folder)
+    mtimes = {
+        file_name: os.stat(os.path.join(abs_folder, file_name)).st_mtime_ns
+        for file_name in _matching_files(abs_folder, name_pattern)
+    }
+    if cached and cached[0] == mtimes:
+        return cached[1]  # type: ignore
+    classes = load_classes_from_folder(folder, name_pattern, base_class, reload=cached is not None)
+    _class_cache[key] = (mtimes, classes)
+    return classes
@@ -0,0 +1,73 @@
+from dataclasses import dataclass, field
+
+from langchain_core.messages import BaseMessage
+
+SUMMARY_FANOUT = 4  # summaries of one level merged into one of the next level
+
+
+@dataclass
+class Summary:
+    """Hierarchical summary of compacted history, shown as one human message.
+
+    Each compaction adds a level 0 part summarising raw messages. Once a level
+    has SUMMARY_FANOUT parts they are merged into one part of the next level,
+    so older history is only ever re-summarised from summaries.
+    """
+
+    parts: list[tuple[int, str]] = field(default_factory=list)  # (level, text), oldest first
+    message: BaseMessage | None = None  # its message in history
+
+    def text(self) -> str:
+        return "\n\n".join(text for _, text in self.parts)
+
+    def add(self, text: str):
+        self.parts.append((0, text))
+
+    def mergeable(self) -> tuple[int, list[str]] | None:
+        """A level with enough parts to merge and their texts."""
+        for level in sorted({level for level, _ in self.parts}):
+            texts = [text for part_level, text in self.parts if part_level == level]
+            if len(texts) >= SUMMARY_FANOUT:
+                return level, texts
+        return None
+
+    def merge(self, level: int, text: str):
+        # parts of a level are contiguous, the merged part takes their place
+        first = next(i for i, (part_level, _) in enumerate(self.parts) if part_level == level)
+        rest = [part for part in self.parts if part[0] != level]
+        self.parts = rest[:first] + [(level + 1, text)] + rest[first:]
+
+    def copy(self) -> "Summary":
+        return Summary(list(self.parts), self.message)
+
+
+def compaction_range(
+    messages: list[BaseMessage], summary: Summary, keep_start: int, keep_end: int
+) -> tuple[int, int] | None:
+    """Start and end of the raw messages to summarise next, None if there are too few.
+
+    The range follows the summary message, or the first `keep_start` messages if
+    there is none yet, and leaves the last `keep_end` messages. It ends with a
+    human message so that human and ai messages keep alternating around the
+    human summary message.
+    """
+    index = _index_of(messages, summary.message)
+    if index is None:
+        start = min(keep_start, len(messages))
+        # the new summary message replaces the first summarised one
+        if start < len(messages) and messages[start].type != "human" and start > 0:
+            start -= 1
+    else:
+        start = index + 1
+    end = len(messages) - keep_end
+    while end > start and messages[end - 1].type != "human":
+        end -= 1
+    if end - start < 2:
+        return None
+    return start, end
+
+
+def _index_of(messages: list[BaseMessage], message: BaseMessage | None) -> int | None:
+    if message is None:
+        return None
+    return next((i for i, m in enumerate(messages) if m is message), None)
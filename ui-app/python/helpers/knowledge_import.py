@@ -1,8 +1,17 @@
 import glob
 import os
 import hashlib
-import json
-from typing import Any, Dict, Literal, TypedDict
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Literal, TypedDict
 from langchain_community.document_loaders import (
     CSVLoader,
     JSONLoader,
@@ -11,115 +20,388 @@ from langchain_community.document_loaders import (
     UnstructuredHTMLLoader,
     UnstructuredMarkdownLoader,
 )
-from python.helpers import files
+from langchain_core.documents import Document
+from python.helpers import files, knowledge_watch
 from python.helpers.log import LogItem
 
+try:
+    import xxhash
+except ImportError:  # optional, blake2b is used without it
+    xxhash = None
+
 text_loader_kwargs = {"autodetect_encoding": True}
 
+# Mapping file extensions to corresponding loader classes
+file_types_loaders = {
+    "txt": TextLoader,
+    "pdf": PyPDFLoader,
+    "csv": CSVLoader,
+    "html": UnstructuredHTMLLoader,
+    "json": JSONLoader,
+    # "md": UnstructuredMarkdownLoader,
+    "md": TextLoader,
+}
+
 
 class KnowledgeImport(TypedDict):
     file: str
     checksum: str
+    size: int
+    mtime_ns: int
+    inode: int
     ids: list[str]
+    chunks: list[str]  # content hash per chunk, aligned with ids
     state: Literal["changed", "original", "removed"]
-    documents: list[Any]
 
 
-def calculate_checksum(file_path: str) -> str:
-    hasher = hashlib.md5()
+@dataclass
+class ImportJob:
+    file: str
+    checksum: str
+    metadata: dict[str, Any]
+    stat: dict[str, int]
+    ids: list[str] = field(default_factory=list)  # of the previous version
+    chunks: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ImportResult:
+    ids: list[str]
+    chunks: list[str]
+
+
+@dataclass
+class ImportProgress:
+    state: Literal["pending", "scanning", "importing", "ready", "failed"] = "pending"
+    files_total: int = 0  # changed files to import
+    files_done: int = 0
+    chunks: int = 0  # embedded and inserted so far
+    error: str = ""
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def calculate_checksum(file_path: str, algorithm: str = "") -> str:
+    """Hash of the file contents, read in chunks, prefixed with the algorithm.
+
+    Checksums without a prefix were written by older versions as plain md5.
+    """
+    algorithm = algorithm or ("xxh3_128" if xxhash else "blake2b")
+    if algorithm == "xxh3_128":
+        hasher = xxhash.xxh3_128()  # type: ignore
+    else:
+        hasher = hashlib.new(algorithm)
     with open(file_path, "rb") as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    if algorithm == "md5":
+        return hasher.hexdigest()
+    return f"{algorithm}:{hasher.hexdigest()}"
 
 
-def load_knowledge(
-    log_item: LogItem | None,
-    knowledge_dir: str,
-    index: Dict[str, KnowledgeImport],
-    metadata: dict[str, Any] = {},
-    filename_pattern: str = "**/*",
-) -> Dict[str, KnowledgeImport]:
+def chunk_hash(doc: Document) -> str:
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def file_stat(file_path: str) -> dict[str, int]:
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
 
-    # from python.helpers.memory import Memory
 
-    # Mapping file extensions to corresponding loader classes
-    file_types_loaders = {
-        "txt": TextLoader,
-        "pdf": PyPDFLoader,
-        "csv": CSVLoader,
-        "html": UnstructuredHTMLLoader,
-        "json": JSONLoader,
-        # "md": UnstructuredMarkdownLoader,
-        "md": TextLoader,
-    }
+def _unchanged_stat(file_data: dict[str, Any], stat: dict[str, int]) -> bool:
+    return bool(file_data.get("checksum")) and all(
+        file_data.get(key) == value for key, value in stat.items()
+    )
 
-    cnt_files = 0
-    cnt_docs = 0
 
-    # for area in Memory.Area:
-    #     subdir = files.get_abs_path(knowledge_dir, area.value)
+def _checksum_like(file_path: str, checksum: str | None) -> str:
+    # hash with the algorithm of the stored checksum so unchanged files still match
+    if checksum and ":" not in checksum:
+        return calculate_checksum(file_path, "md5")
+    if checksum and xxhash is None and checksum.startswith("xxh3_128:"):
+        return calculate_checksum(file_path, "blake2b")
+    return calculate_checksum(file_path, checksum.split(":")[0] if checksum else "")
 
-    # if not os.path.exists(knowledge_dir):
-    #     os.makedirs(knowledge_dir)
-    #     continue
 
+def scan_knowledge(
+    log_item: LogItem | None,
+    knowledge_dir: str,
+    index: Dict[str, KnowledgeImport],
+    metadata: dict[str, Any] = {},
+    filename_pattern: str = "**/*",
+    changed: set[str] | None = None,
+) -> list[ImportJob]:
+    """Mark the files of `knowledge_dir` in `index` as original or changed.
+
+    Returns an import job for every changed file, the documents are loaded
+    later by `run_import`. Files never seen by any scan keep no state and are
+    marked removed by `mark_removed`. With `changed` only files at or below
+    these paths are checked.
+    """
     # Fetch all files in the directory with specified extensions
     kn_files = glob.glob(knowledge_dir + "/" + filename_pattern, recursive=True)
     kn_files = [f for f in kn_files if os.path.isfile(f)]
+    if changed is not None:
+        kn_files = [f for f in kn_files if knowledge_watch.affected(f, changed)]
 
     if kn_files:
-        print(
-            f"Found {len(kn_files)} knowledge files in {knowledge_dir}, processing..."
-        )
+        print(f"Found {len(kn_files)} knowledge files in {knowledge_dir}, checking...")
         if log_item:
             log_item.stream(
-                progress=f"\nFound {len(kn_files)} knowledge files in {knowledge_dir}, processing...",
+                progress=f"\nFound {len(kn_files)} knowledge files in {knowledge_dir}, checking...",
             )
 
+    kn_files = [f for f in kn_files if f.split(".")[-1].lower() in file_types_loaders]
+    stats = {file_path: file_stat(file_path) for file_path in kn_files}
+
+    # only files whose size, mtime or inode changed are read and hashed
+    to_hash = [
+        file_path
+        for file_path in kn_files
+        if not _unchanged_stat(index.get(file_path, {}), stats[file_path])
+    ]
+    def checksum_of(file_path: str) -> str:
+        return _checksum_like(file_path, index.get(file_path, {}).get("checksum"))
+
+    with ThreadPoolExecutor(max_workers=min(8, len(to_hash) or 1)) as pool:
+        checksums = dict(zip(to_hash, pool.map(checksum_of, to_hash)))
+
+    jobs = []
     for file_path in kn_files:
-        ext = file_path.split(".")[-1].lower()
-        if ext in file_types_loaders:
-            checksum = calculate_checksum(file_path)
-            file_key = file_path  # os.path.relpath(file_path, knowledge_dir)
-
-            # Load existing data from the index or create a new entry
-            file_data = index.get(file_key, {})
-
-            if file_data.get("checksum") == checksum:
-                file_data["state"] = "original"
-            else:
-                file_data["state"] = "changed"
-
-            if file_data["state"] == "changed":
-                file_data["checksum"] = checksum
-                loader_cls = file_types_loaders[ext]
-                loader = loader_cls(
-                    file_path,
-                    **(
-                        text_loader_kwargs
-                        if ext in ["txt", "csv", "html", "md"]
-                        else {}
-                    ),
+        file_key = file_path  # os.path.relpath(file_path, knowledge_dir)
+
+        # Load existing data from the index or create a new entry
+        file_data = index.get(file_key, {})
+        checksum = checksums.get(file_path, file_data.get("checksum"))
+
+        if file_data.get("checksum") == checksum:
+            file_data["state"] = "original"
+            file_data.update(stats[file_path])  # type: ignore
+        else:
+            file_data["state"] = "changed"
+            if checksum and ":" not in checksum:
+                checksum = calculate_checksum(file_path)  # md5 only to compare old entries
+            jobs.append(
+                ImportJob(
+                    file_key,
+                    checksum,  # type: ignore
+                    metadata,
+                    stats[file_path],
+                    file_data.get("ids", []),
+                    file_data.get("chunks", []),
                 )
-                file_data["documents"] = loader.load_and_split()
-                for doc in file_data["documents"]:
-                    doc.metadata = {**doc.metadata, **metadata}
-                cnt_files += 1
-                cnt_docs += len(file_data["documents"])
-                # print(f"Imported {len(file_data['documents'])} documents from {file_path}")
+            )
+
+        # Update the index
+        index[file_key] = file_data  # type: ignore
 
-            # Update the index
-            index[file_key] = file_data  # type: ignore
+    return jobs
 
+
+def mark_removed(index: Dict[str, KnowledgeImport]):
     # loop index where state is not set and mark it as removed
     for file_key, file_data in index.items():
         if not file_data.get("state", ""):
             index[file_key]["state"] = "removed"
 
-    print(f"Processed {cnt_docs} documents from {cnt_files} files.")
+
+def load_file(file_path: str, metadata: dict[str, Any]) -> list[Document]:
+    ext = file_path.split(".")[-1].lower()
+    loader_cls = file_types_loaders[ext]
+    loader = loader_cls(
+        file_path,
+        **(text_loader_kwargs if ext in ["txt", "csv", "html", "md"] else {}),
+    )
+    documents = loader.load_and_split()
+    for doc in documents:
+        doc.metadata = {**doc.metadata, **metadata}
+    return documents
+
+
+def run_import(
+    log_item: LogItem | None,
+    jobs: list[ImportJob],
+    embed: Callable[[list[str]], list[list[float]]],
+    insert: Callable[[list[Document], list[list[float]]], list[str]],
+    workers: int = 0,
+    batch_size: int = 64,
+    queue_size: int = 4,
+    progress: ImportProgress | None = None,
+) -> Dict[str, ImportResult]:
+    """Load, embed and insert the files of `jobs` as a streaming pipeline.
+
+    Files are parsed and split in a process pool, their chunks are embedded in
+    batches of `batch_size` on a second thread and inserted by the calling one.
+    Stages are connected by queues of `queue_size` items, so a slow stage holds
+    back the ones before it instead of piling documents up in memory.
+    Chunks whose content hash was already imported for the previous version of
+    a file keep their id and are not embedded again.
+    Returns the ids and chunk hashes per file, files that failed to load are
+    left out. Previous ids missing from a result are no longer used.
+    """
+    if not jobs:
+        return {}
+    parsed: queue.Queue = queue.Queue(maxsize=queue_size)
+    embedded: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    results: Dict[str, ImportResult] = {}
+
+    def parse():
+        try:
+            for job, docs in _parse(jobs, workers, queue_size, stop):
+                results[job.file], new_docs = _diff_chunks(job, docs)
+                _put(parsed, (job, new_docs), stop)
+            _put(parsed, None, stop)
+        except BaseException as e:
+            _put(parsed, e, stop)
+
+    def embed_batches():
+        try:
+            for batch in _batches(parsed, batch_size):
+                docs = [doc for _, doc in batch if doc is not None]
+                vectors = embed([doc.page_content for doc in docs]) if docs else []
+                _put(embedded, (batch, vectors), stop)
+            _put(embedded, None, stop)
+        except BaseException as e:
+            _put(embedded, e, stop)
+
+    threads = [
+        threading.Thread(target=parse, daemon=True),
+        threading.Thread(target=embed_batches, daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    files_done: set[str] = set()
+    slots: Dict[str, Iterator[int]] = {}
+    chunks = 0
+    try:
+        while (item := embedded.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            batch, vectors = item
+            chunk_jobs = [job for job, doc in batch if doc is not None]
+            inserted = (
+                insert([doc for _, doc in batch if doc is not None], vectors)
+                if chunk_jobs
+                else []
+            )
+            for job, _ in batch:
+                files_done.add(job.file)
+            for job, id in zip(chunk_jobs, inserted):
+                # new chunks arrive in file order and fill the gaps between reused ones
+                result = results[job.file]
+                if job.file not in slots:
+                    slots[job.file] = iter(
+                        [i for i, slot in enumerate(result.ids) if not slot]
+                    )
+                result.ids[next(slots[job.file])] = id
+            chunks += len(chunk_jobs)
+            if progress:
+                progress.files_done, progress.chunks = len(files_done), chunks
+            _progress(log_item, f"Imported {chunks} chunks from {len(files_done)}/{len(jobs)} files")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return {file: results[file] for file in files_done}
+
+
+def _diff_chunks(
+    job: ImportJob, docs: list[Document]
+) -> tuple[ImportResult, list[Document]]:
+    # reuse ids of unchanged chunks, the rest is left empty for the documents to insert
+    previous: Dict[str, list[str]] = {}
+    for digest, id in zip(job.chunks, job.ids):
+        previous.setdefault(digest, []).append(id)
+    result = ImportResult(ids=[], chunks=[])
+    new_docs = []
+    for doc in docs:
+        digest = chunk_hash(doc)
+        result.chunks.append(digest)
+        if previous.get(digest):
+            result.ids.append(previous[digest].pop(0))
+        else:
+            result.ids.append("")
+            new_docs.append(doc)
+    return result, new_docs
+
+
+def _parse(
+    jobs: list[ImportJob], workers: int, max_pending: int, stop: threading.Event
+) -> Iterator[tuple[ImportJob, list[Document]]]:
+    # a few files in flight per worker, the rest waits until results are taken
+    if workers == 1:
+        for job in jobs:
+            docs = _load_or_skip(job, lambda: load_file(job.file, job.metadata))
+            if docs is not None:
+                yield job, docs
+        return
+    workers = workers or min(8, os.cpu_count() or 1)
+    # forking would copy the parent's threads and locks, e.g. the memory locks
+    # and the watcher, into the workers
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        pending = {}
+        remaining = iter(jobs)
+        while not stop.is_set():
+            while len(pending) < workers + max_pending:
+                job = next(remaining, None)
+                if job is None:
+                    break
+                pending[pool.submit(load_file, job.file, job.metadata)] = job
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                docs = _load_or_skip(job, future.result)
+                if docs is not None:
+                    yield job, docs
+        for future in pending:
+            future.cancel()
+
+
+def _load_or_skip(job: ImportJob, load: Callable[[], list[Document]]):
+    try:
+        return load()
+    except Exception as e:
+        print(f"Failed to load knowledge file {job.file}: {e}")
+        return None
+
+
+def _batches(
+    parsed: queue.Queue, batch_size: int
+) -> Iterator[list[tuple[ImportJob, Document | None]]]:
+    # chunks of several files share a batch, a file may span several batches,
+    # a file without chunks is passed as None so it still counts as imported
+    batch: list[tuple[ImportJob, Document | None]] = []
+    while (item := parsed.get()) is not None:
+        if isinstance(item, BaseException):
+            raise item
+        job, docs = item
+        for doc in docs or [None]:
+            batch.append((job, doc))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event):
+    # blocks while the next stage is busy, gives up once the pipeline is stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _progress(log_item: LogItem | None, text: str):
+    print(text)
     if log_item:
-        log_item.stream(
-            progress=f"\nProcessed {cnt_docs} documents from {cnt_files} files."
-        )
-    return index
+        log_item.stream(progress=f"\n{text}")
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from typing import Callable
+
+try:
+    from watchdog.events import FileSystemEvent, FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional, directories are polled without it
+    Observer = None
+    FileSystemEventHandler = object
+    FileSystemEvent = None
+
+DEBOUNCE = 2.0  # seconds without further changes before an update runs
+POLL_INTERVAL = 5.0
+
+
+class KnowledgeWatcher:
+    """Calls `on_change` with the paths changed under `dirs`, once they settle.
+
+    Uses inotify (or the platform equivalent) through watchdog when installed and
+    polls file stats otherwise. Paths may be directories, meaning everything
+    below them changed, e.g. when a folder is moved in or out.
+    """
+
+    def __init__(
+        self,
+        dirs: list[str],
+        on_change: Callable[[set[str]], None],
+        debounce: float = DEBOUNCE,
+    ):
+        self.dirs = dirs
+        self.on_change = on_change
+        self.debounce = debounce
+        self._changed: set[str] = set()
+        self._last_change = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._observer = None
+
+    def start(self):
+        if Observer is not None:
+            self._observer = Observer()
+            handler = _Handler(self.changed)
+            for folder in self.dirs:
+                if os.path.isdir(folder):
+                    self._observer.schedule(handler, folder, recursive=True)
+            self._observer.start()
+        else:
+            self._threads.append(threading.Thread(target=self._poll, daemon=True))
+        self._threads.append(threading.Thread(target=self._dispatch, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+
+    def changed(self, path: str):
+        with self._lock:
+            self._changed.add(path)
+            self._last_change = time.monotonic()
+
+    def _dispatch(self):
+        # one update per burst of events, a file written in several steps is imported once
+        while not self._stop.wait(self.debounce / 4):
+            with self._lock:
+                if not self._changed or time.monotonic() - self._last_change < self.debounce:
+                    continue
+                changed, self._changed = self._changed, set()
+            try:
+                self.on_change(changed)
+            except Exception as e:
+                print(f"Knowledge update failed: {e}")
+
+    def _poll(self):
+        previous = self._stats()
+        while not self._stop.wait(POLL_INTERVAL):
+            current = self._stats()
+            for path in previous.keys() | current.keys():
+                if previous.get(path) != current.get(path):
+                    self.changed(path)
+            previous = current
+
+    def _stats(self) -> dict[str, tuple[int, int, int]]:
+        stats = {}
+        for folder in self.dirs:
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue  # removed while walking
+                    stats[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return stats
+
+
+class _Handler(FileSystemEventHandler):  # type: ignore
+    def __init__(self, changed: Callable[[str], None]):
+        self.changed = changed
+
+    def on_any_event(self, event: "FileSystemEvent"):  # type: ignore
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        self.changed(os.fsdecode(event.src_path))
+        if getattr(event, "dest_path", ""):
+            self.changed(os.fsdecode(event.dest_path))
+
+
+def affected(path: str, changed: set[str]) -> bool:
+    """Whether `path` is one of the changed paths or below a changed directory."""
+    return any(path == c or path.startswith(c.rstrip(os.sep) + os.sep) for c in changed)
@@ -1,36 +1,982 @@
+from dataclasses import asdict
 from datetime import datetime
 from typing import Any, List, Sequence
-from langchain.storage import InMemoryByteStore, LocalFileStore
+from langchain.storage import InMemoryByteStore
 from langchain.embeddings import CacheBackedEmbeddings
 
 # from langchain_chroma import Chroma
 from langchain_community.vectorstores import FAISS
 import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores.utils import (
     DistanceStrategy,
 )
-import os, json
+import os, json, mmap, shutil, threading, hashlib, re, asyncio
+from contextlib import contextmanager
+from pathlib import Path
 
 import numpy as np
 from . import files
 from langchain_core.documents import Document
 import uuid
-from python.helpers import knowledge_import
-from python.helpers.log import Log, LogItem
+from python.helpers import embedding_cache, knowledge_import, knowledge_watch, memory_index
+from python.helpers.memory_docstore import OffsetDocstore
+from python.helpers.memory_filter import MetadataColumns, compile_filter
+from python.helpers.memory_journal import MemoryJournal
+from python.helpers.memory_lexical import LexicalIndex, reciprocal_rank_fusion
+from python.helpers import memory_recall, memory_retention
+from python.helpers.memory_retention import AccessStats
+from python.helpers.rwlock import FileLock, RWLock
+from python.helpers.log import LogItem
 from enum import Enum
 from agent import Agent
 
 
 class MyFaiss(FAISS):
+    journal: MemoryJournal
+    folder: str
+    docstore: OffsetDocstore
+
+    SNAPSHOT_DIR = "snapshot"
+    GENERATION_FILE = "generation"
+
+    # index file mapped at open and read on first use, see open_snapshot
+    _index: Any = None
+    _index_map: mmap.mmap | None = None
+    _manifest: dict[str, Any] = {}
+    generation = 0  # snapshots written so far, other processes reload when it changes
+    index_params: dict[str, Any] | None = None
+    trained_on = 0  # vectors the index was trained on, 0 if unknown
+
+    # keyword index, built on the first lexical search
+    lexical: LexicalIndex | None = None
+
+    # positions deleted from an index that cannot remove vectors, see purge
+    tombstones: np.ndarray | None = None
+
+    def __init__(
+        self,
+        *args,
+        columns: MetadataColumns | None = None,
+        access: AccessStats | None = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._lexical_lock = threading.Lock()
+        # recall counts for retention policies, aligned with index positions like columns
+        self.access = access or AccessStats(len(self.index_to_docstore_id))
+        # metadata columns aligned with index positions, used for pre-filtering
+        self.columns = columns if columns is not None else MetadataColumns.from_metadatas(
+            (
+                _with_hash(self.docstore.search(id))  # type: ignore
+                for _, id in sorted(self.index_to_docstore_id.items())
+            ),
+            UNIQUE_KEYS,
+        )
+
+    @property
+    def index(self) -> Any:
+        if self._index is None and self._index_map is not None:
+            # mapped when the snapshot was opened, a newer snapshot cannot slip in
+            data = np.frombuffer(self._index_map, dtype=np.uint8)
+            self._index = faiss.deserialize_index(data)
+            del data
+            self._index_map.close()
+            self._index_map = None
+            memory_index.set_search_params(self._index, self.index_params)
+        return self._index
+
+    @index.setter
+    def index(self, value: Any):
+        self._index = value
+
+    def index_type(self) -> str:
+        if self._index is None and self._manifest:
+            return self._manifest["index_type"]
+        return memory_index.index_type_of(self.index)
+
+    def dim(self) -> int:
+        if self._index is None and self._manifest:
+            return self._manifest["dim"]
+        return self.index.d
+
+    @classmethod
+    def open_snapshot(
+        cls, folder: str, embeddings: Any, **kwargs: Any
+    ) -> "MyFaiss | None":
+        """Open the snapshot in `folder` without reading the index or documents yet."""
+        snapshot = _recover_snapshot(os.path.join(folder, MyFaiss.SNAPSHOT_DIR))
+        if snapshot:
+            with open(os.path.join(snapshot, "manifest.json"), "r") as f:
+                manifest = json.load(f)
+            ids = manifest["ids"]
+            db = cls(
+                embeddings,
+                None,
+                OffsetDocstore(snapshot, ids),
+                dict(enumerate(ids)),
+                columns=MetadataColumns.load(snapshot, UNIQUE_KEYS),
+                access=AccessStats.load(snapshot, len(ids)),
+                **kwargs,
+            )
+            with open(os.path.join(snapshot, "index.faiss"), "rb") as f:
+                db._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            db._manifest = manifest
+            db.generation = read_generation(folder)
+            db.trained_on = manifest.get("trained_on", 0)
+            return db
+
+        if os.path.exists(os.path.join(folder, "index.faiss")):
+            # pickled snapshot of older versions, rewritten on the next compaction
+            db = cls.load_local(
+                folder_path=folder,
+                embeddings=embeddings,
+                allow_dangerous_deserialization=True,
+                **kwargs,
+            )
+            db.docstore = OffsetDocstore.from_documents(db.docstore._dict)  # type: ignore
+            return db  # type: ignore
+        return None
+
     # override aget_by_ids
     def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
-        # return all self.docstore._dict[id] in ids
-        return [self.docstore._dict[id] for id in ids if id in self.docstore._dict]  # type: ignore
+        return [doc for id in ids if (doc := self.docstore.get(id)) is not None]
 
     async def aget_by_ids(self, ids: Sequence[str], /) -> List[Document]:
         return self.get_by_ids(ids)
 
+    def apply_insert(self, docs: list[Document], vectors: list[list[float]]):
+        # idempotent, journal replay may see documents already in the snapshot
+        new = [
+            (doc, vector)
+            for doc, vector in zip(docs, vectors)
+            if doc.metadata["id"] not in self.docstore
+        ]
+        if new:
+            self.add_embeddings(
+                [(doc.page_content, vector) for doc, vector in new],
+                metadatas=[doc.metadata for doc, _ in new],
+                ids=[doc.metadata["id"] for doc, _ in new],
+            )
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        text_embeddings = list(text_embeddings)
+        if self.tombstones is None:
+            ids = super().add_embeddings(text_embeddings, metadatas, ids, **kwargs)
+        else:
+            # langchain numbers new positions from the mapping size, tombstones
+            # leave gaps in it, so map them after the end of the index instead
+            start = self.index.ntotal
+            mapping, self.index_to_docstore_id = self.index_to_docstore_id, {}
+            try:
+                ids = super().add_embeddings(text_embeddings, metadatas, ids, **kwargs)
+            finally:
+                added, self.index_to_docstore_id = self.index_to_docstore_id, mapping
+            mapping.update((start + pos, id) for pos, id in added.items())
+        self.columns.append(
+            [
+                {**(metadatas[i] if metadatas else {}), CONTENT_HASH: _content_hash(text)}
+                for i, (text, _) in enumerate(text_embeddings)
+            ]
+        )
+        self.access.append(len(ids))
+        if self.tombstones is not None:
+            self.tombstones = np.concatenate(
+                [self.tombstones, np.zeros(len(ids), dtype=bool)]
+            )
+        if self.lexical is not None:
+            self.lexical.add(ids, [text for text, _ in text_embeddings])
+        return ids
+
+    def delete(self, ids: list[str] | None = None, **kwargs: Any) -> bool | None:
+        remove = set(ids or [])
+        if self.lexical is not None:
+            docs = self.get_by_ids(list(remove))
+            self.lexical.remove(
+                [doc.metadata["id"] for doc in docs], [doc.page_content for doc in docs]
+            )
+        positions = {
+            pos for pos, id in self.index_to_docstore_id.items() if id in remove
+        }
+        if ids is None or memory_index.supports_remove(self.index):
+            result = super().delete(ids, **kwargs)
+            self.columns.remove(positions)
+            self.access.remove(positions)
+            return result
+
+        # index cannot compact positions on remove, hide them from searches until
+        # the next snapshot rebuilds it
+        if self.tombstones is None:
+            self.tombstones = np.zeros(self.index.ntotal, dtype=bool)
+        self.tombstones[list(positions)] = True
+        self.docstore.delete(list(remove))
+        for pos in positions:
+            del self.index_to_docstore_id[pos]
+        return True
+
+    def live(self, mask: np.ndarray | None = None) -> np.ndarray | None:
+        """`mask` without tombstoned positions, None if nothing is excluded."""
+        if self.tombstones is None:
+            return mask
+        return ~self.tombstones if mask is None else mask & ~self.tombstones
+
+    def purge(self):
+        """Rebuild the index without tombstoned positions and renumber the rest."""
+        if self.tombstones is None:
+            return
+        positions = set(np.flatnonzero(self.tombstones).tolist())
+        self.index = memory_index.rebuild_without(self.index, positions)
+        self.columns.remove(positions)
+        self.access.remove(positions)
+        remaining = [id for _, id in sorted(self.index_to_docstore_id.items())]
+        self.index_to_docstore_id = dict(enumerate(remaining))
+        self.tombstones = None
+
+    def migrate_index(
+        self, index_type: str, params: dict[str, Any] | None = None
+    ) -> dict[str, Any] | None:
+        # train the configured index type on the stored vectors once there are enough of them
+        self.index_params = params
+        n = len(self.index_to_docstore_id)
+        if not memory_index.can_migrate(
+            self.index_type(), n, index_type, params, self.trained_on
+        ):
+            if self._index is not None:
+                memory_index.set_search_params(self._index, params)
+            return None
+        self.purge()
+        vectors = memory_index.reconstruct_all(self.index)
+        self.index = memory_index.build(vectors, index_type, params)
+        self.trained_on = n
+        return memory_index.report(self.index, vectors)
+
+    def search_with_scores(
+        self,
+        embeddings: np.ndarray,
+        limits: list[int],
+        score_thresholds: list[float],
+        filter: str = "",
+        with_vectors: bool = False,
+    ) -> list[list[tuple]]:
+        """Search a batch of query vectors sharing one filter in a single faiss call.
+
+        Results are (document, relevance) pairs, with the stored vector appended
+        if `with_vectors` is set.
+        """
+        # the filter is applied inside the faiss search, not on its results
+        mask = self.live(compile_filter(filter).mask(self.columns) if filter else None)
+        if not self.index_to_docstore_id or (mask is not None and not mask.any()):
+            return [[] for _ in limits]
+        scores, indices = memory_index.search(self.index, embeddings, max(limits), mask)
+        relevance = self._select_relevance_score_fn()
+        results = []
+        recalled = []
+        for row, (k, score_threshold) in enumerate(zip(limits, score_thresholds)):
+            docs = []
+            for score, i in zip(scores[row][:k], indices[row][:k]):
+                if i == -1 or relevance(score) < score_threshold:
+                    continue
+                doc = self.docstore.get(self.index_to_docstore_id[i])
+                if with_vectors:
+                    docs.append((doc, relevance(score), self.index.reconstruct(int(i))))
+                else:
+                    docs.append((doc, relevance(score)))
+                recalled.append(i)
+            results.append(docs)
+        # counts results of this shard, some may lose the merge with other shards
+        self.access.touch(np.array(recalled, dtype=np.int64))
+        return results
+
+    def find_duplicates(
+        self, docs: list[Document], vectors: np.ndarray, threshold: float
+    ) -> list[str | None]:
+        """Id of an existing document each new one duplicates, or None.
+
+        Same content is found by hash, near duplicates by a nearest neighbour
+        search at `threshold` relevance, 0 for exact copies only. Repeats within
+        `docs` map to the first. Knowledge chunks are never returned, they are
+        deleted with their source file.
+        """
+        found: list[str | None] = []
+        first: dict[str, str] = {}
+        nearest = (
+            memory_index.search(self.index, vectors, 1, self.live())
+            if self.index_to_docstore_id and threshold
+            else None
+        )
+        excluded = self.excluded()
+        relevance = self._select_relevance_score_fn()
+        for row, doc in enumerate(docs):
+            digest = _content_hash(doc.page_content)
+            same = self.columns.rows_with(CONTENT_HASH, digest)
+            same = same[~excluded[same]]
+            neighbour = int(nearest[1][row][0]) if nearest is not None else -1
+            if len(same):
+                found.append(self.index_to_docstore_id[int(same[0])])
+            elif digest in first:
+                found.append(first[digest])
+            elif (
+                neighbour != -1
+                and not excluded[neighbour]
+                and relevance(nearest[0][row][0]) >= threshold  # type: ignore
+            ):
+                found.append(self.index_to_docstore_id[neighbour])
+            else:
+                first[digest] = doc.metadata["id"]
+                found.append(None)
+        return found
+
+    def duplicate_ids(self, threshold: float, batch: int = 1024) -> list[str]:
+        """Ids of stored documents that duplicate an older one, for batch cleanup.
+
+        Knowledge chunks are left out on both sides.
+        """
+        n = self.index.ntotal
+        duplicate = np.zeros(n, dtype=bool)
+        excluded = self.excluded()
+
+        # same content, keep the first position of every hash
+        codes = np.where(excluded, 0, self.columns.codes(CONTENT_HASH))
+        _, first = np.unique(codes, return_index=True)
+        duplicate[codes != 0] = True
+        duplicate[first] = False
+        duplicate[codes == 0] = False
+
+        # near duplicates, a position is dropped if an older kept one is close enough
+        if threshold and n:
+            relevance = self._select_relevance_score_fn()
+            k = min(n, 8)
+            for start in range(0, n, batch):
+                positions = np.arange(start, min(start + batch, n))
+                vectors = self.index.reconstruct_batch(positions)
+                scores, neighbours = memory_index.search(
+                    self.index, vectors, k, self.live()
+                )
+                for position, row_scores, row_neighbours in zip(
+                    positions, scores, neighbours
+                ):
+                    if duplicate[position] or excluded[position]:
+                        continue
+                    for score, neighbour in zip(row_scores, row_neighbours):
+                        if (
+                            0 <= neighbour < position
+                            and not duplicate[neighbour]
+                            and not excluded[neighbour]
+                            and relevance(score) >= threshold
+                        ):
+                            duplicate[position] = True
+                            break
+        return [self.index_to_docstore_id[int(i)] for i in np.flatnonzero(duplicate)]
+
+    def excluded(self) -> np.ndarray:
+        """Knowledge chunks and tombstones, left out of deduplication and retention."""
+        excluded = _knowledge_rows(self.columns)
+        return excluded if self.tombstones is None else excluded | self.tombstones
+
+    def lexical_index(self) -> LexicalIndex:
+        # built from the docstore once, inserts and deletes keep it up to date afterwards
+        with self._lexical_lock:
+            if self.lexical is None:
+                lexical = LexicalIndex()
+                ids = list(self.index_to_docstore_id.values())
+                lexical.add(ids, (self.docstore.get(id).page_content for id in ids))  # type: ignore
+                self.lexical = lexical
+            return self.lexical
+
+    def search_lexical(
+        self, query: str, limit: int, filter: str = "", min_match: float = 0.0
+    ) -> list[tuple[Document, float]]:
+        condition = compile_filter(filter) if filter else None
+        results = []
+        for id, score in self.lexical_index().search(query, min_match=min_match):
+            doc = self.docstore.get(id)
+            if doc is None or (condition and not condition.matches(doc.metadata)):
+                continue
+            results.append((doc, score))
+            if len(results) >= limit:
+                break
+        return results
+
+    def search_range(
+        self, embedding: np.ndarray, score_threshold: float, filter: str = ""
+    ) -> list[str]:
+        """Ids of all documents at or above the relevance threshold, in one range search."""
+        mask = self.live(compile_filter(filter).mask(self.columns) if filter else None)
+        if not self.index_to_docstore_id or (mask is not None and not mask.any()):
+            return []
+        # relevance is (1 + cosine) / 2, see Memory._cosine_normalizer
+        radius = 2 * score_threshold - 1
+        positions, _ = memory_index.range_search(self.index, embedding, radius, mask)
+        return [self.index_to_docstore_id[int(i)] for i in positions]
+
+    def apply_delete(self, ids: list[str]):
+        existing = [id for id in ids if id in self.docstore]
+        if existing:
+            self.delete(ids=existing)
+
+    def snapshot(self, folder_path: str):
+        # capture in memory now, write to disk later (see MemoryJournal.compact)
+        self.purge()
+        self.columns.compact()
+        self.generation += 1
+        generation = self.generation
+        index_bytes = faiss.serialize_index(self.index)
+        ids = [id for _, id in sorted(self.index_to_docstore_id.items())]
+        entries = self.docstore.capture(ids)
+        columns = self.columns.copy()
+        access = self.access.copy()
+        manifest = {
+            "ids": ids,
+            "index_type": memory_index.index_type_of(self.index),
+            "dim": self.index.d,
+            "trained_on": self.trained_on,
+        }
+
+        def persist():
+            tmp = os.path.join(folder_path, MyFaiss.SNAPSHOT_DIR + ".tmp")
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            with open(os.path.join(tmp, "index.faiss"), "wb") as f:
+                f.write(index_bytes.tobytes())
+            OffsetDocstore.write(tmp, entries)
+            columns.save(tmp)
+            access.save(tmp)
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            with open(os.path.join(tmp, MyFaiss.GENERATION_FILE), "w") as f:
+                f.write(str(generation))
+            for name in os.listdir(tmp):
+                _fsync(os.path.join(tmp, name))
+            _swap_snapshot(os.path.join(folder_path, MyFaiss.SNAPSHOT_DIR), tmp)
+
+            # pickled snapshot of older versions is superseded now
+            for name in ["index.faiss", "index.pkl"]:
+                if os.path.exists(os.path.join(folder_path, name)):
+                    os.remove(os.path.join(folder_path, name))
+
+        return persist
+
+    def compact(self, wait: bool = False):
+        self.journal.compact(lambda: self.snapshot(self.folder))
+        if wait:
+            self.journal.wait()
+
+
+class MemoryDb:
+    """Vector store of one memory subdir, split into one FAISS shard per area.
+
+    Searches whose filter names areas only touch those shards, results from
+    several shards are merged by score.
+
+    Searches run in parallel, writes are exclusive. With `shared` the subdir can
+    be used by several processes: writes also take an exclusive file lock and
+    bump a version file, and every process catches up on the journals of the
+    others when it sees a new version.
+    """
+
+    SHARDS_DIR = "shards"
+    VERSION_FILE = "version"
+
+    def __init__(
+        self,
+        embedder: CacheBackedEmbeddings,
+        db_dir: str,
+        index_type: str = memory_index.FLAT,
+        index_params: dict[str, Any] | None = None,
+        shared: bool = False,
+        query_cache: embedding_cache.QueryCache | None = None,
+    ):
+        self.embedder = embedder
+        self.model = Memory._model_name(embedder.underlying_embeddings)
+        self.query_cache = query_cache
+        self.db_dir = db_dir
+        self.index_type = index_type
+        self.index_params = index_params
+        self.shards: dict[str, MyFaiss] = {}
+        self._dim = 0
+        self.lock = RWLock()
+        self.shared = shared
+        self.file_lock = FileLock(os.path.join(db_dir, ".lock")) if shared else None
+        self.version = 0
+        self._sweeper: threading.Thread | None = None
+        self._stop_sweeper = threading.Event()
+
+    def load(self, log_item: LogItem | None):
+        with self.lock.write(), self._file_lock_exclusive():
+            shards_dir = os.path.join(self.db_dir, MemoryDb.SHARDS_DIR)
+            if os.path.isdir(shards_dir):
+                for area in sorted(os.listdir(shards_dir)):
+                    self.shards[area] = self._load_shard(area, log_item)
+
+            # single index written before areas were sharded
+            if files.exists(self.db_dir, "index.faiss") or files.exists(
+                self.db_dir, MemoryJournal.FILE
+            ):
+                self._split_legacy(log_item)
+            self.version = self._read_version()
+
+    @contextmanager
+    def reading(self):
+        if self.shared and self._read_version() != self.version:
+            with self.lock.write(), self.file_lock.shared():  # type: ignore
+                self._catch_up()
+        with self.lock.read():
+            yield
+
+    @contextmanager
+    def writing(self):
+        with self.lock.write(), self._file_lock_exclusive():
+            self._catch_up()
+            yield
+            if self.shared:
+                self._bump_version()
+
+    @contextmanager
+    def _file_lock_exclusive(self):
+        if self.file_lock:
+            with self.file_lock.exclusive():
+                yield
+        else:
+            yield
+
+    def _catch_up(self):
+        # apply what other processes wrote since our last look
+        if not self.shared:
+            return
+        version = self._read_version()
+        if version == self.version:
+            return
+        shards_dir = os.path.join(self.db_dir, MemoryDb.SHARDS_DIR)
+        for area in sorted(os.listdir(shards_dir)) if os.path.isdir(shards_dir) else []:
+            shard = self.shards.get(area)
+            if (
+                shard is None
+                or shard.generation != read_generation(self._shard_dir(area))
+                or not shard.journal.replay_new(shard.apply_insert, shard.apply_delete)
+            ):
+                self.shards[area] = self._open(self._shard_dir(area), None)
+        self.version = version
+
+    def _read_version(self) -> int:
+        try:
+            with open(os.path.join(self.db_dir, MemoryDb.VERSION_FILE)) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_version(self):
+        self.version = self._read_version() + 1
+        _write_atomic(
+            Path(self.db_dir, MemoryDb.VERSION_FILE), str(self.version).encode()
+        )
+
+    def _shard(self, area: str) -> MyFaiss:
+        if area not in self.shards:
+            self.shards[area] = self._load_shard(area, None)
+        return self.shards[area]
+
+    def _route(self, filter: str = "") -> list[MyFaiss]:
+        areas = compile_filter(filter).values_of("area") if filter else None
+        if areas is None:
+            return list(self.shards.values())
+        return [self.shards[area] for area in areas if area in self.shards]
+
+    async def aembed_query(self, query: str) -> list[float]:
+        if self.query_cache:
+            cached = self.query_cache.get_many(self.model, [query])[0]
+            if cached is not None:
+                return cached
+        vector = await self.embedder.underlying_embeddings.aembed_query(query)
+        if self.query_cache:
+            self.query_cache.put_many(self.model, [query], [vector])
+        return vector
+
+    async def aembed_queries(self, queries: list[str]) -> list[list[float]]:
+        cached = (
+            self.query_cache.get_many(self.model, queries)
+            if self.query_cache
+            else [None] * len(queries)
+        )
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, cached) if vector is None))
+        if not missing:
+            return cached  # type: ignore
+        # embedded as queries like aembed_query, concurrently for everything not cached yet
+        vectors = await asyncio.gather(
+            *[self.embedder.underlying_embeddings.aembed_query(query) for query in missing]
+        )
+        if self.query_cache:
+            self.query_cache.put_many(self.model, missing, vectors)
+        embedded = dict(zip(missing, vectors))
+        return [
+            vector if vector is not None else embedded[query]
+            for query, vector in zip(queries, cached)
+        ]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embedder.embed_documents(texts)
+
+    def search_by_vectors(
+        self,
+        embeddings: list[list[float]],
+        limits: list[int],
+        score_thresholds: list[float],
+        filters: list[str],
+    ) -> list[list[Document]]:
+        results = self.search_candidates(embeddings, limits, score_thresholds, filters)
+        return [[doc for doc, *_ in docs] for docs in results]
+
+    def search_candidates(
+        self,
+        embeddings: list[list[float]],
+        limits: list[int],
+        score_thresholds: list[float],
+        filters: list[str],
+        with_vectors: bool = False,
+    ) -> list[list[tuple]]:
+        """Like search_by_vectors, with relevance and optionally the stored vectors."""
+        vectors = np.array(embeddings, dtype=np.float32)
+        results: list[list[tuple]] = [[] for _ in embeddings]
+
+        # queries with the same filter are stacked into one search per shard
+        groups: dict[str, list[int]] = {}
+        for i, filter in enumerate(filters):
+            groups.setdefault(filter, []).append(i)
+
+        with self.reading():
+            for filter, rows in groups.items():
+                for shard in self._route(filter):
+                    found = shard.search_with_scores(
+                        vectors[rows],
+                        [limits[i] for i in rows],
+                        [score_thresholds[i] for i in rows],
+                        filter,
+                        with_vectors,
+                    )
+                    for i, docs in zip(rows, found):
+                        results[i] += docs
+
+        # merge shards by score
+        for docs in results:
+            docs.sort(key=lambda result: result[1], reverse=True)
+        return [docs[:k] for k, docs in zip(limits, results)]
+
+    def search_lexical(
+        self, query: str, limit: int, filter: str = "", min_match: float = 0.0
+    ) -> list[Document]:
+        results: list[tuple[Document, float]] = []
+        with self.reading():
+            for shard in self._route(filter):
+                results += shard.search_lexical(query, limit, filter, min_match)
+        results.sort(key=lambda result: result[1], reverse=True)
+        return [doc for doc, _ in results[:limit]]
+
+    def get_by_ids(self, ids: Sequence[str]) -> list[Document]:
+        docs = []
+        with self.reading():
+            for shard in self.shards.values():
+                docs += shard.get_by_ids(ids)
+        return docs
+
+    def insert(
+        self,
+        docs: list[Document],
+        vectors: list[list[float]],
+        dedup_threshold: float | None = None,
+    ) -> list[str]:
+        """Insert documents, returns their ids.
+
+        With `dedup_threshold` documents duplicating a stored one of the same area
+        are skipped and the id of the stored one is returned in their place,
+        0 only skips exact copies.
+        """
+        ids = [doc.metadata["id"] for doc in docs]
+        with self.writing():
+            for area, rows in _group_by_area(docs).items():
+                shard = self._shard(area)
+                if dedup_threshold is not None:
+                    duplicates = shard.find_duplicates(
+                        [docs[i] for i in rows],
+                        np.array([vectors[i] for i in rows], dtype=np.float32),
+                        dedup_threshold,
+                    )
+                    for i, existing in zip(rows, duplicates):
+                        ids[i] = existing or ids[i]
+                    rows = [i for i, existing in zip(rows, duplicates) if not existing]
+                if not rows:
+                    continue
+                shard_docs = [docs[i] for i in rows]
+                shard_vectors = [vectors[i] for i in rows]
+                shard.apply_insert(shard_docs, shard_vectors)
+                shard.journal.append_insert(shard_docs, shard_vectors)
+        return ids
+
+    def sweep(self, policies: dict[str, dict[str, Any]]) -> int:
+        """Apply per-area retention policies, returns how many memories were removed.
+
+        Deletes are journaled in one batch per area and the affected shards are
+        compacted once afterwards.
+        """
+        removed = 0
+        with self.writing():
+            for area, policy in policies.items():
+                shard = self.shards.get(area)
+                if shard is None or not policy:
+                    continue
+                # knowledge chunks go with their source files, not by age or use
+                positions = memory_retention.expired(
+                    policy, shard.columns, shard.access, exclude=shard.excluded()
+                )
+                if not len(positions):
+                    continue
+                ids = [shard.index_to_docstore_id[int(i)] for i in positions]
+                shard.apply_delete(ids)
+                shard.journal.append_delete(ids)
+                self._compact(shard)
+                removed += len(ids)
+                print(f"Retention removed {len(ids)} memories from area '{area}'.")
+        return removed
+
+    def start_sweeper(self, policies: dict[str, dict[str, Any]], interval: float):
+        """Sweep retention policies every `interval` seconds on a daemon thread."""
+        if self._sweeper:
+            return
+
+        def run():
+            while not self._stop_sweeper.wait(interval):
+                try:
+                    self.sweep(policies)
+                except Exception as e:
+                    print(f"Memory retention sweep failed: {e}")
+
+        self._sweeper = threading.Thread(target=run, daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop_sweeper.set()
+
+    def deduplicate(self, threshold: float) -> int:
+        """Delete stored documents duplicating older ones, returns how many."""
+        removed = 0
+        with self.writing():
+            for shard in self.shards.values():
+                ids = shard.duplicate_ids(threshold)
+                if ids:
+                    shard.apply_delete(ids)
+                    shard.journal.append_delete(ids)
+                    removed += len(ids)
+        return removed
+
+    def delete_matching(
+        self, embedding: list[float], threshold: float, filter: str = ""
+    ) -> list[Document]:
+        """Delete every document at or above the threshold in one pass per shard."""
+        vector = np.array(embedding, dtype=np.float32)
+        removed = []
+        with self.writing():
+            for shard in self._route(filter):
+                ids = shard.search_range(vector, threshold, filter)
+                if ids:
+                    removed += shard.get_by_ids(ids)
+                    shard.apply_delete(ids)
+                    shard.journal.append_delete(ids)
+        return removed
+
+    def delete(self, ids: list[str]) -> list[Document]:
+        removed = []
+        with self.writing():
+            for shard in self.shards.values():
+                found = shard.get_by_ids(ids)
+                if found:
+                    found_ids = [doc.metadata["id"] for doc in found]
+                    shard.apply_delete(found_ids)
+                    shard.journal.append_delete(found_ids)
+                    removed += found
+        return removed
+
+    def persist(self, max_ops: int):
+        # operations are already durable in the journals, fold them into snapshots once they grow
+        with self.writing():
+            for shard in self.shards.values():
+                if shard.journal.ops >= max_ops:
+                    self._compact(shard)
+
+    def compact(self, wait: bool = False):
+        with self.writing():
+            for shard in self.shards.values():
+                self._compact(shard, wait)
+
+    def _compact(self, shard: MyFaiss, wait: bool = False):
+        if not shard.journal.is_compacting():
+            migrated = shard.migrate_index(self.index_type, self.index_params)
+            if migrated:
+                Memory._log_migration(None, migrated)
+        # other processes must not reload while the snapshot is half written
+        shard.compact(wait or self.shared)
+
+    def _shard_dir(self, area: str) -> str:
+        return os.path.join(self.db_dir, MemoryDb.SHARDS_DIR, area)
+
+    def _load_shard(self, area: str, log_item: LogItem | None) -> MyFaiss:
+        db = self._open(self._shard_dir(area), log_item)
+        # migrate existing index to the configured type and persist it right away
+        migrated = db.migrate_index(self.index_type, self.index_params)
+        if migrated:
+            Memory._log_migration(log_item, migrated)
+            db.compact(wait=self.shared)
+        return db
+
+    def _open(self, folder: str, log_item: LogItem | None) -> MyFaiss:
+        os.makedirs(folder, exist_ok=True)
+        db = MyFaiss.open_snapshot(
+            folder,
+            self.embedder,
+            distance_strategy=DistanceStrategy.COSINE,
+            # normalize_L2=True,
+            relevance_score_fn=Memory._cosine_normalizer,
+        )
+        if db is None:
+            # types that need training start flat and migrate once there is enough data
+            index = memory_index.create_index(
+                self._get_dim(),
+                (
+                    memory_index.FLAT
+                    if memory_index.needs_training(self.index_type)
+                    else self.index_type
+                ),
+                self.index_params,
+            )
+
+            db = MyFaiss(
+                embedding_function=self.embedder,
+                index=index,
+                docstore=OffsetDocstore(),
+                index_to_docstore_id={},
+                distance_strategy=DistanceStrategy.COSINE,
+                # normalize_L2=True,
+                relevance_score_fn=Memory._cosine_normalizer,
+            )
+
+        # replay operations written after the last snapshot
+        db.index_params = self.index_params
+        db.folder = folder
+        db.journal = MemoryJournal(folder)
+        replayed = db.journal.replay(db.apply_insert, db.apply_delete)
+        if replayed:
+            print(f"Replayed {replayed} journaled memory operations.")
+            if log_item:
+                log_item.stream(
+                    progress=f"\nReplayed {replayed} journaled memory operations"
+                )
+        return db
+
+    def _get_dim(self) -> int:
+        if not self._dim:
+            existing = next(iter(self.shards.values()), None)
+            self._dim = (
+                existing.dim()
+                if existing
+                else len(self.embedder.embed_query("example"))
+            )
+        return self._dim
+
+    def _split_legacy(self, log_item: LogItem | None):
+        print("Splitting VectorDB into area shards...")
+        if log_item:
+            log_item.stream(progress="\nSplitting VectorDB into area shards")
+
+        legacy = self._open(self.db_dir, log_item)
+        self._dim = legacy.dim()
+        vectors = memory_index.reconstruct_all(legacy.index)
+        docs = [
+            legacy.docstore.get(id)
+            for _, id in sorted(legacy.index_to_docstore_id.items())
+        ]
+        for area, rows in _group_by_area(docs).items():
+            shard = self._shard(area)
+            shard.apply_insert([docs[i] for i in rows], vectors[rows].tolist())
+            shard.compact(wait=True)
+
+        # keep the old files as a backup, they are no longer loaded
+        for name in ["index.faiss", "index.pkl"]:
+            if files.exists(self.db_dir, name):
+                os.replace(
+                    os.path.join(self.db_dir, name),
+                    os.path.join(self.db_dir, name + ".bak"),
+                )
+        for name in [MemoryJournal.FILE, MemoryJournal.COMPACTING]:
+            if files.exists(self.db_dir, name):
+                os.remove(os.path.join(self.db_dir, name))
+
+
+# metadata column with the content hash of every document, kept out of the docstore
+CONTENT_HASH = "_hash"
+KNOWLEDGE_SOURCE = "source"
+UNIQUE_KEYS = ("id", CONTENT_HASH)  # metadata columns not worth dictionary encoding
+
+
+def _content_hash(text: str) -> str:
+    # whitespace differences do not make a new memory
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _knowledge_rows(columns: MetadataColumns) -> np.ndarray:
+    # chunks imported from knowledge files, their loaders always set the source path
+    return columns.codes(KNOWLEDGE_SOURCE) != 0
+
+
+def _with_hash(doc: Document) -> dict[str, Any]:
+    return {**doc.metadata, CONTENT_HASH: _content_hash(doc.page_content)}
+
+
+def _group_by_area(docs: list[Document]) -> dict[str, list[int]]:
+    groups: dict[str, list[int]] = {}
+    for i, doc in enumerate(docs):
+        area = doc.metadata.get("area") or Memory.Area.MAIN.value
+        groups.setdefault(area, []).append(i)
+    return groups
+
+
+def _fsync(path: str):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _swap_snapshot(current: str, new: str):
+    old = current + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(current):
+        os.rename(current, old)
+    os.rename(new, current)
+    # open documents of the old snapshot stay readable through their mappings
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def read_generation(folder: str) -> int:
+    """Generation of the snapshot in a shard folder, 0 if it has none."""
+    try:
+        with open(
+            os.path.join(folder, MyFaiss.SNAPSHOT_DIR, MyFaiss.GENERATION_FILE)
+        ) as f:
+            return int(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _recover_snapshot(current: str) -> str | None:
+    # a crash while swapping leaves only the old snapshot, both are valid with the journal
+    if not os.path.exists(current) and os.path.exists(current + ".old"):
+        os.rename(current + ".old", current)
+    return current if os.path.exists(current) else None
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 
 class Memory:
 
@@ -40,35 +986,128 @@ class Memory:
         SOLUTIONS = "solutions"
         INSTRUMENTS = "instruments"
 
-    index: dict[str, "MyFaiss"] = {}
+    index: dict[str, MemoryDb] = {}
+    preloads: dict[str, knowledge_import.ImportProgress] = {}  # by memory subdir
+    _preload_threads: dict[str, threading.Thread] = {}
+    _watchers: dict[str, knowledge_watch.KnowledgeWatcher] = {}
+    HYBRID_CANDIDATES = 4  # results per search fused in hybrid search, times the limit
+    HYBRID_MIN_MATCH = 0.3  # share of the query keywords a lexical hit must match, see LexicalIndex.search
+    _index_lock = threading.Lock()  # guards the registry, each MemoryDb has its own lock
 
     @staticmethod
     async def get(agent: Agent):
         memory_subdir = agent.config.memory_subdir or "default"
-        if Memory.index.get(memory_subdir) is None:
-            log_item = agent.context.log.log(
-                type="util",
-                heading=f"Initializing VectorDB in '/{memory_subdir}'",
-            )
-            db = Memory.initialize(
-                log_item,
-                agent.config.embeddings_model,
-                memory_subdir,
-                False,
-            )
-            Memory.index[memory_subdir] = db
-            wrap = Memory(agent, db, memory_subdir=memory_subdir)
-            if agent.config.knowledge_subdirs:
-                await wrap.preload_knowledge(
-                    log_item, agent.config.knowledge_subdirs, memory_subdir
+        log_item = None
+        with Memory._index_lock:
+            db = Memory.index.get(memory_subdir)
+            if db is None:
+                log_item = agent.context.log.log(
+                    type="util",
+                    heading=f"Initializing VectorDB in '/{memory_subdir}'",
                 )
-            return wrap
-        else:
-            return Memory(
-                agent=agent,
-                db=Memory.index[memory_subdir],
-                memory_subdir=memory_subdir,
+                db = Memory.initialize(
+                    log_item,
+                    agent.config.embeddings_model,
+                    memory_subdir,
+                    False,
+                    agent.config.memory_index_type,
+                    agent.config.memory_index_params,
+                    agent.config.memory_shared,
+                    agent.config.embeddings_cache_max_mb,
+                    agent.config.embeddings_query_cache_size,
+                    agent.config.embeddings_query_cache_persist,
+                )
+                Memory.index[memory_subdir] = db
+                if agent.config.memory_retention:
+                    db.start_sweeper(
+                        agent.config.memory_retention,
+                        agent.config.memory_sweep_interval,
+                    )
+
+        wrap = Memory(agent, db, memory_subdir=memory_subdir)
+        if log_item and agent.config.knowledge_subdirs:
+            wrap.start_preload(
+                log_item, agent.config.knowledge_subdirs, agent.config.knowledge_watch
             )
+        return wrap
+
+    def start_preload(
+        self, log_item: LogItem | None, kn_dirs: list[str], watch: bool = False
+    ):
+        """Import knowledge on a daemon thread, searches meanwhile see what is already stored.
+
+        With `watch`, files changed afterwards are imported as they change.
+        """
+        progress = knowledge_import.ImportProgress()
+        Memory.preloads[self.memory_subdir] = progress
+
+        def run():
+            try:
+                asyncio.run(
+                    self.preload_knowledge(
+                        log_item, kn_dirs, self.memory_subdir, progress
+                    )
+                )
+                progress.state = "ready"
+            except Exception as e:
+                progress.state, progress.error = "failed", str(e)
+                print(f"Knowledge preload of '{self.memory_subdir}' failed: {e}")
+            if watch:
+                self._start_watcher(kn_dirs, progress)
+
+        thread = threading.Thread(target=run, daemon=True)
+        Memory._preload_threads[self.memory_subdir] = thread
+        thread.start()
+
+    def _start_watcher(
+        self, kn_dirs: list[str], progress: knowledge_import.ImportProgress
+    ):
+        def update(changed: set[str]):
+            print(f"Knowledge changed, updating {len(changed)} paths...")
+            try:
+                asyncio.run(
+                    self.preload_knowledge(
+                        None, kn_dirs, self.memory_subdir, progress, changed
+                    )
+                )
+                progress.state, progress.error = "ready", ""
+            except Exception as e:
+                progress.state, progress.error = "failed", str(e)
+                print(f"Knowledge update of '{self.memory_subdir}' failed: {e}")
+
+        watcher = knowledge_watch.KnowledgeWatcher(
+            [files.get_abs_path("knowledge", kn_dir) for kn_dir in kn_dirs]
+            + [files.get_abs_path("instruments")],
+            update,
+        )
+        Memory._watchers[self.memory_subdir] = watcher
+        watcher.start()
+
+    @staticmethod
+    def stop_watchers():
+        for watcher in Memory._watchers.values():
+            watcher.stop()
+        Memory._watchers.clear()
+
+    @staticmethod
+    def wait_for_preload(memory_subdir: str, timeout: float | None = None) -> bool:
+        thread = Memory._preload_threads.get(memory_subdir)
+        if thread:
+            thread.join(timeout)
+        return Memory.preloads.get(memory_subdir, knowledge_import.ImportProgress("ready")).state == "ready"
+
+    @staticmethod
+    def preload_status() -> dict[str, dict[str, Any]]:
+        return {subdir: asdict(progress) for subdir, progress in Memory.preloads.items()}
+
+    @staticmethod
+    def query_cache_status() -> dict[str, dict[str, Any]]:
+        """Hit rate of the query embedding cache per memory subdir."""
+        return {
+            subdir: db.query_cache.stats()
+            for subdir, db in list(Memory.index.items())
+            if db.query_cache
+        }
 
     @staticmethod
     def initialize(
@@ -76,7 +1115,13 @@ class Memory:
         embeddings_model,
         memory_subdir: str,
         in_memory=False,
-    ) -> MyFaiss:
+        index_type: str = memory_index.FLAT,
+        index_params: dict[str, Any] | None = None,
+        shared: bool = False,
+        cache_max_mb: int = 0,
+        query_cache_size: int = 0,
+        query_cache_persist: bool = False,
+    ) -> MemoryDb:
 
         print("Initializing VectorDB...")
 
@@ -86,6 +1131,7 @@ class Memory:
         em_dir = files.get_abs_path(
             "memory/embeddings"
         )  # just caching, no need to parameterize
+        em_file = files.get_abs_path("memory/embeddings.db")
         db_dir = Memory._abs_db_dir(memory_subdir)
 
         # make sure embeddings and database directories exist
@@ -94,52 +1140,65 @@ class Memory:
         if in_memory:
             store = InMemoryByteStore()
         else:
-            os.makedirs(em_dir, exist_ok=True)
-            store = LocalFileStore(em_dir)
+            store = embedding_cache.open_store(em_file, cache_max_mb * 1024 * 1024)
+            if os.path.isdir(em_dir):
+                Memory._migrate_embeddings(log_item, store, em_dir)
 
         # here we setup the embeddings model with the chosen cache storage
         embedder = CacheBackedEmbeddings.from_bytes_store(
             embeddings_model,
             store,
-            namespace=getattr(
-                embeddings_model,
-                "model",
-                getattr(embeddings_model, "model_name", "default"),
-            ),
+            namespace=Memory._model_name(embeddings_model),
         )
 
         # self.db = Chroma(
         #     embedding_function=self.embedder,
         #     persist_directory=db_dir)
 
-        # if db folder exists and is not empty:
-        if os.path.exists(db_dir) and files.exists(db_dir, "index.faiss"):
-            db = MyFaiss.load_local(
-                folder_path=db_dir,
-                embeddings=embedder,
-                allow_dangerous_deserialization=True,
-                distance_strategy=DistanceStrategy.COSINE,
-                # normalize_L2=True,
-                relevance_score_fn=Memory._cosine_normalizer,
+        query_cache = (
+            embedding_cache.query_cache(
+                query_cache_size,
+                store if query_cache_persist and not in_memory else None,
             )
-        else:
-            index = faiss.IndexFlatIP(len(embedder.embed_query("example")))
+            if query_cache_size
+            else None
+        )
 
-            db = MyFaiss(
-                embedding_function=embedder,
-                index=index,
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={},
-                distance_strategy=DistanceStrategy.COSINE,
-                # normalize_L2=True,
-                relevance_score_fn=Memory._cosine_normalizer,
-            )
-        return db  # type: ignore
+        db = MemoryDb(embedder, db_dir, index_type, index_params, shared, query_cache)
+        db.load(log_item)
+        return db
+
+    @staticmethod
+    def _model_name(embeddings_model) -> str:
+        return getattr(
+            embeddings_model,
+            "model",
+            getattr(embeddings_model, "model_name", "default"),
+        )
+
+    @staticmethod
+    def _migrate_embeddings(
+        log_item: LogItem | None, store: embedding_cache.SqliteByteStore, em_dir: str
+    ):
+        # one file per embedding from older versions, moved into the cache file once
+        print("Migrating embeddings cache...")
+        if log_item:
+            log_item.stream(progress="\nMigrating embeddings cache")
+        count = embedding_cache.migrate_from_dir(
+            store,
+            em_dir,
+            progress=lambda n: (
+                log_item.stream(progress=f"\nMigrated {n} cached embeddings")
+                if log_item
+                else None
+            ),
+        )
+        print(f"Migrated {count} cached embeddings.")
 
     def __init__(
         self,
         agent: Agent,
-        db: MyFaiss,
+        db: MemoryDb,
         memory_subdir: str,
     ):
         self.agent = agent
@@ -147,7 +1206,12 @@ class Memory:
         self.memory_subdir = memory_subdir
 
     async def preload_knowledge(
-        self, log_item: LogItem | None, kn_dirs: list[str], memory_subdir: str
+        self,
+        log_item: LogItem | None,
+        kn_dirs: list[str],
+        memory_subdir: str,
+        progress: knowledge_import.ImportProgress | None = None,
+        changed: set[str] | None = None,
     ):
         # db abs path
         db_dir = Memory._abs_db_dir(memory_subdir)
@@ -164,115 +1228,209 @@ class Memory:
             with open(index_path, "r") as f:
                 index = json.load(f)
 
-        # preload knowledge folders
-        index = self._preload_knowledge_folders(log_item, kn_dirs, index)
+        # find changed files, documents are only loaded by the import below
+        progress = progress or knowledge_import.ImportProgress()
+        progress.state = "scanning"
+        if changed is not None:
+            # files outside the changed paths stay as they are
+            for file in index:
+                if not knowledge_watch.affected(file, changed):
+                    index[file]["state"] = "original"
+        jobs = self._scan_knowledge_folders(log_item, kn_dirs, index, changed)
+        progress.state, progress.files_total = "importing", len(jobs)
 
-        for file in index:
-            if index[file]["state"] in ["changed", "removed"] and index[file].get(
-                "ids", []
-            ):  # for knowledge files that have been changed or removed and have IDs
-                await self.delete_documents_by_ids(
-                    index[file]["ids"]
-                )  # remove original version
-            if index[file]["state"] == "changed":
-                index[file]["ids"] = self.insert_documents(
-                    index[file]["documents"]
-                )  # insert new version
+        # insert new chunks of changed files as they are parsed and embedded,
+        # unchanged chunks keep their ids
+        imported = await asyncio.to_thread(
+            knowledge_import.run_import,
+            log_item,
+            jobs,
+            self.db.embed_documents,
+            self._insert_batch,
+            self.agent.config.knowledge_import_workers,
+            progress=progress,
+        )
+        for job in jobs:
+            if job.file in imported:
+                index[job.file]["checksum"] = job.checksum
+                index[job.file].update(job.stat)  # type: ignore
+                index[job.file]["ids"] = imported[job.file].ids
+                index[job.file]["chunks"] = imported[job.file].chunks
+            # files that failed to load keep the old checksum and are retried next time
+
+        # remove chunks no longer used and removed files in one go
+        outdated = [
+            id
+            for job in jobs
+            if job.file in imported
+            for id in set(job.ids) - set(imported[job.file].ids)
+        ] + [
+            id
+            for file in index
+            if index[file]["state"] == "removed"
+            for id in index[file].get("ids", [])
+        ]
+        if outdated:
+            self.db.delete(outdated)
+        self._persist()
 
         # remove index where state="removed"
         index = {k: v for k, v in index.items() if v["state"] != "removed"}
 
-        # strip state and documents from index and save it
+        # strip state from index and save it
         for file in index:
-            if "documents" in index[file]:
-                del index[file]["documents"]  # type: ignore
             if "state" in index[file]:
                 del index[file]["state"]  # type: ignore
         with open(index_path, "w") as f:
             json.dump(index, f)
 
-    def _preload_knowledge_folders(
+    def _scan_knowledge_folders(
         self,
         log_item: LogItem | None,
         kn_dirs: list[str],
         index: dict[str, knowledge_import.KnowledgeImport],
-    ):
+        changed: set[str] | None = None,
+    ) -> list[knowledge_import.ImportJob]:
+        jobs = []
         # load knowledge folders, subfolders by area
         for kn_dir in kn_dirs:
             for area in Memory.Area:
-                index = knowledge_import.load_knowledge(
+                jobs += knowledge_import.scan_knowledge(
                     log_item,
                     files.get_abs_path("knowledge", kn_dir, area.value),
                     index,
                     {"area": area.value},
+                    changed=changed,
                 )
 
         # load instruments descriptions
-        index = knowledge_import.load_knowledge(
+        jobs += knowledge_import.scan_knowledge(
             log_item,
             files.get_abs_path("instruments"),
             index,
             {"area": Memory.Area.INSTRUMENTS.value},
             filename_pattern="**/*.md",
+            changed=changed,
         )
 
-        return index
+        knowledge_import.mark_removed(index)
+        return jobs
+
+    def _insert_batch(
+        self, docs: list[Document], vectors: list[list[float]]
+    ) -> list[str]:
+        # journaled right away, persisted once after the import; never deduplicated,
+        # ids recorded per file must not be shared with other files or memories
+        timestamp = self.get_timestamp()
+        for doc in docs:
+            doc.metadata["id"] = str(uuid.uuid4())
+            doc.metadata["timestamp"] = timestamp
+        return self.db.insert(docs, vectors)
 
     async def search_similarity_threshold(
         self, query: str, limit: int, threshold: float, filter: str = ""
     ):
-        comparator = Memory._get_comparator(filter) if filter else None
-        return await self.db.asearch(
-            query,
-            search_type="similarity_score_threshold",
-            k=limit,
-            score_threshold=threshold,
-            filter=comparator,
-        )
+        embedding = await self.db.aembed_query(query)
+        return self.db.search_by_vectors([embedding], [limit], [threshold], [filter])[0]
 
-    async def delete_documents_by_query(
-        self, query: str, threshold: float, filter: str = ""
+    async def search_hybrid(
+        self, query: str, limit: int, threshold: float, filter: str = ""
     ):
-        k = 100
-        tot = 0
-        removed = []
+        """Vector search fused with BM25 keyword search by reciprocal rank.
+
+        Finds exact identifiers like error codes or hostnames that similarity
+        alone ranks low. The threshold applies to the vector results, keyword
+        results must match at least HYBRID_MIN_MATCH of the query keywords.
+        """
+        candidates = limit * Memory.HYBRID_CANDIDATES
+        embedding = await self.db.aembed_query(query)
+        similar = self.db.search_by_vectors(
+            [embedding], [candidates], [threshold], [filter]
+        )[0]
+        lexical = self.db.search_lexical(
+            query, candidates, filter, Memory.HYBRID_MIN_MATCH
+        )
+        return reciprocal_rank_fusion([similar, lexical], limit)
+
+    async def search_many(
+        self,
+        queries: list[str],
+        limit: int | list[int],
+        threshold: float | list[float],
+        filter: str | list[str] = "",
+    ) -> list[list[Document]]:
+        """Search several queries at once, returns one result list per query.
 
-        while True:
-            # Perform similarity search with score
-            docs = await self.search_similarity_threshold(
-                query, limit=k, threshold=threshold, filter=filter
+        Queries are embedded in one batch and searched with one faiss call per
+        shard and filter. Limit, threshold and filter may be given per query.
+        """
+        if not queries:
+            return []
+        n = len(queries)
+        limits = limit if isinstance(limit, list) else [limit] * n
+        thresholds = threshold if isinstance(threshold, list) else [threshold] * n
+        filters = filter if isinstance(filter, list) else [filter] * n
+
+        unique = list(dict.fromkeys(queries))
+        vectors = dict(zip(unique, await self.db.aembed_queries(unique)))
+        return self.db.search_by_vectors(
+            [vectors[query] for query in queries], limits, thresholds, filters
+        )
+
+    async def recall_many(
+        self,
+        queries: list[str],
+        limit: int | list[int],
+        threshold: float | list[float],
+        filter: str | list[str] = "",
+    ) -> list[memory_recall.Recall]:
+        """Search like search_many, then pick diverse results that fit the token budget.
+
+        More candidates than `limit` are fetched per query and selected by maximal
+        marginal relevance over their stored vectors, within
+        AgentConfig.memory_recall_token_budget tokens per query.
+        """
+        if not queries:
+            return []
+        n = len(queries)
+        limits = limit if isinstance(limit, list) else [limit] * n
+        thresholds = threshold if isinstance(threshold, list) else [threshold] * n
+        filters = filter if isinstance(filter, list) else [filter] * n
+
+        unique = list(dict.fromkeys(queries))
+        vectors = dict(zip(unique, await self.db.aembed_queries(unique)))
+        candidates = self.db.search_candidates(
+            [vectors[query] for query in queries],
+            [k * memory_recall.CANDIDATES for k in limits],
+            thresholds,
+            filters,
+            with_vectors=True,
+        )
+        return [
+            memory_recall.select(
+                found,
+                np.array(vectors[query], dtype=np.float32),
+                k,
+                self.agent.config.memory_recall_token_budget,
+                self.agent.config.memory_recall_mmr_lambda,
             )
-            removed += docs
-
-            # Extract document IDs and filter based on score
-            # document_ids = [result[0].metadata["id"] for result in docs if result[1] < score_limit]
-            document_ids = [result.metadata["id"] for result in docs]
-
-            # Delete documents with IDs over the threshold score
-            if document_ids:
-                # fnd = self.db.get(where={"id": {"$in": document_ids}})
-                # if fnd["ids"]: self.db.delete(ids=fnd["ids"])
-                # tot += len(fnd["ids"])
-                self.db.delete(ids=document_ids)
-                tot += len(document_ids)
-
-            # If fewer than K document IDs, break the loop
-            if len(document_ids) < k:
-                break
+            for query, found, k in zip(queries, candidates, limits)
+        ]
 
-        if tot:
-            self._save_db()  # persist
+    async def delete_documents_by_query(
+        self, query: str, threshold: float, filter: str = ""
+    ):
+        # one range search collects every match, no search and delete rounds
+        embedding = await self.db.aembed_query(query)
+        removed = self.db.delete_matching(embedding, threshold, filter)
+        if removed:
+            self._persist()
         return removed
 
     async def delete_documents_by_ids(self, ids: list[str]):
-        # aget_by_ids is not yet implemented in faiss, need to do a workaround
-        rem_docs = self.db.get_by_ids(ids)  # existing docs to remove (prevents error)
-        if rem_docs:
-            rem_ids = [doc.metadata["id"] for doc in rem_docs]  # ids to remove
-            await self.db.adelete(ids=rem_ids)
-
+        rem_docs = self.db.delete(ids)  # only existing docs are removed
         if rem_docs:
-            self._save_db()  # persist
+            self._persist()
         return rem_docs
 
     def insert_text(self, text, metadata: dict = {}):
@@ -280,16 +1438,16 @@ class Memory:
         if not metadata.get("area", ""):
             metadata["area"] = Memory.Area.MAIN.value
 
-        self.db.add_documents(
-            documents=[
+        # returns the id of an existing duplicate instead if there is one
+        id = self._add_documents(
+            [
                 Document(
                     text,
                     metadata={"id": id, "timestamp": self.get_timestamp(), **metadata},
                 )
-            ],
-            ids=[id],
-        )
-        self._save_db()  # persist
+            ]
+        )[0]
+        self._persist()
         return id
 
     def insert_documents(self, docs: list[Document]):
@@ -299,23 +1457,37 @@ class Memory:
             for doc, id in zip(docs, ids):
                 doc.metadata["id"] = id  # add ids to documents metadata
                 doc.metadata["timestamp"] = timestamp  # add timestamp
-            self.db.add_documents(documents=docs, ids=ids)
-            self._save_db()  # persist
+            ids = self._add_documents(docs)
+            self._persist()
         return ids
 
-    def _save_db(self):
-        self.db.save_local(folder_path=self._abs_db_dir(self.memory_subdir))
+    def _add_documents(self, docs: list[Document]) -> list[str]:
+        vectors = self.db.embed_documents([doc.page_content for doc in docs])
+        return self.db.insert(
+            docs, vectors, self.agent.config.memory_dedup_threshold
+        )
 
-    @staticmethod
-    def _get_comparator(condition: str):
-        def comparator(data: dict[str, Any]):
-            try:
-                return eval(condition, {}, data)
-            except Exception as e:
-                # print(f"Error evaluating condition: {e}")
-                return False
+    def deduplicate(self, threshold: float | None = None) -> int:
+        """Remove duplicates already stored in this memory subdir."""
+        if threshold is None:
+            threshold = self.agent.config.memory_dedup_threshold
+        removed = self.db.deduplicate(threshold)
+        if removed:
+            self.db.compact()
+        return removed
+
+    def _persist(self):
+        self.db.persist(self.agent.config.memory_journal_max_ops)
 
-        return comparator
+    def compact(self, wait: bool = False):
+        self.db.compact(wait)
+
+    @staticmethod
+    def _log_migration(log_item: LogItem | None, report: dict[str, Any]):
+        text = ", ".join(f"{k}: {v}" for k, v in report.items())
+        print(f"Migrated VectorDB index: {text}")
+        if log_item:
+            log_item.stream(progress=f"\nMigrated VectorDB index: {text}")
 
     @staticmethod
     def _score_normalizer(val: float) -> float:
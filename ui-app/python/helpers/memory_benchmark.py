@@ -0,0 +1,79 @@
+import os
+import sys
+from typing import Any
+
+import faiss
+import numpy as np
+
+from python.helpers import files, memory_index
+
+# index settings compared by the benchmark, (type, params)
+CONFIGS: list[tuple[str, dict[str, Any]]] = [
+    (memory_index.FLAT, {}),
+    (memory_index.FP16, {}),
+    (memory_index.SQ8, {}),
+    (memory_index.SQ8, {"rerank": 4}),
+    (memory_index.IVF_PQ, {}),
+    (memory_index.IVF_PQ, {"rerank": 8}),
+    (memory_index.IVF_PQ, {"rerank": 8, "rerank_storage": memory_index.FLAT}),
+]
+
+
+def load_vectors(memory_subdir: str) -> np.ndarray:
+    """All stored vectors of a memory subdir, read from its shard snapshots."""
+    db_dir = files.get_abs_path("memory", memory_subdir)
+    paths = [os.path.join(db_dir, "index.faiss")]
+    shards_dir = os.path.join(db_dir, "shards")
+    if os.path.isdir(shards_dir):
+        for area in sorted(os.listdir(shards_dir)):
+            paths += [
+                os.path.join(shards_dir, area, "snapshot", "index.faiss"),
+                os.path.join(shards_dir, area, "index.faiss"),
+            ]
+
+    parts = []
+    for path in paths:
+        if os.path.exists(path):
+            index = faiss.read_index(path)
+            if memory_index.index_type_of(index) != memory_index.FLAT:
+                print(f"Note: {path} is {memory_index.index_type_of(index)}, its vectors are already lossy")
+            parts.append(memory_index.reconstruct_all(index))
+    if not parts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.concatenate(parts)
+
+
+def run(vectors: np.ndarray, k: int = 10) -> list[dict[str, Any]]:
+    results = []
+    for index_type, params in CONFIGS:
+        if memory_index.needs_training(index_type) and len(
+            vectors
+        ) < memory_index.min_train_size(
+            index_type, memory_index.params_with_defaults(params), len(vectors)
+        ):
+            continue  # not enough vectors to train it, memory would stay flat too
+        index = memory_index.build(vectors, index_type, params)
+        result = memory_index.report(index, vectors, k)
+        result["params"] = params
+        result["bytes/vector"] = round(result["bytes"] / len(vectors), 1)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    # python -m python.helpers.memory_benchmark [memory subdir] [k]
+    subdir = sys.argv[1] if len(sys.argv) > 1 else "default"
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    vectors = load_vectors(subdir)
+    if not len(vectors):
+        print(f"No stored vectors found in memory/{subdir}")
+        sys.exit(1)
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]} from memory/{subdir}\n")
+
+    print(f"{'type':<16} {'params':<48} {'bytes/vector':>12} {'compression':>11} {f'recall@{k}':>10}")
+    for result in run(vectors, k):
+        print(
+            f"{result['type']:<16} {str(result['params']):<48} {result['bytes/vector']:>12} "
+            f"{result['compression']:>11} {result[f'recall@{k}']:>10}"
+        )
@@ -0,0 +1,32 @@
+import argparse
+
+from initialize import initialize
+from python.helpers.memory import Memory
+
+if __name__ == "__main__":
+    # python -m python.helpers.memory_dedup [subdir ...] [--threshold 0.98]
+    parser = argparse.ArgumentParser(
+        description="Remove duplicate memories from memory subdirs and compact them."
+    )
+    parser.add_argument("subdirs", nargs="*", default=["default"])
+    parser.add_argument("--threshold", type=float, default=None)
+    args = parser.parse_args()
+
+    config = initialize()
+    threshold = (
+        args.threshold if args.threshold is not None else config.memory_dedup_threshold
+    )
+    for subdir in args.subdirs:
+        db = Memory.initialize(
+            None,
+            config.embeddings_model,
+            subdir,
+            False,
+            config.memory_index_type,
+            config.memory_index_params,
+            config.memory_shared,
+            config.embeddings_cache_max_mb,
+        )
+        removed = db.deduplicate(threshold)
+        db.compact(wait=True)
+        print(f"Removed {removed} duplicate memories from memory/{subdir}")
@@ -0,0 +1,112 @@
+import json
+import mmap
+import os
+from typing import Any, Iterable
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+DOCS_FILE = "docs.jsonl"
+OFFSETS_FILE = "offsets.npy"
+
+
+class OffsetDocstore(Docstore, AddableMixin):
+    """Docstore backed by a JSON lines file and an array of line offsets.
+
+    Opening it only maps the files, a document is parsed when it is looked up.
+    Documents added after the file was written are kept in memory until the
+    next snapshot writes a new file.
+    """
+
+    def __init__(
+        self,
+        folder: str | None = None,
+        ids: Iterable[str] = (),
+    ):
+        self._mmap: mmap.mmap | None = None
+        self._offsets: np.ndarray = np.zeros((0, 2), dtype=np.int64)
+        self._rows: dict[str, int] = {}
+        self._added: dict[str, Document] = {}
+
+        if folder and os.path.getsize(os.path.join(folder, DOCS_FILE)):
+            with open(os.path.join(folder, DOCS_FILE), "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._offsets = np.load(os.path.join(folder, OFFSETS_FILE), mmap_mode="r")
+            self._rows = {id: row for row, id in enumerate(ids)}
+
+    @staticmethod
+    def from_documents(docs: dict[str, Document]) -> "OffsetDocstore":
+        store = OffsetDocstore()
+        store._added = dict(docs)
+        return store
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._added or id in self._rows
+
+    def __len__(self) -> int:
+        return len(self._added) + len(self._rows)
+
+    def get(self, id: str) -> Document | None:
+        if id in self._added:
+            return self._added[id]
+        row = self._rows.get(id)
+        if row is None:
+            return None
+        return _decode(self._line(row))
+
+    def search(self, search: str) -> str | Document:
+        doc = self.get(search)
+        return doc if doc is not None else f"ID {search} not found."
+
+    def add(self, texts: dict[str, Document]) -> None:
+        overlapping = [id for id in texts if id in self]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids: list) -> None:
+        if not any(id in self for id in ids):
+            raise ValueError(f"Tried to delete ids that does not  exist: {ids}")
+        for id in ids:
+            if self._added.pop(id, None) is None:
+                self._rows.pop(id, None)
+
+    def capture(self, ids: list[str]) -> list[bytes | Document]:
+        """Entries for a snapshot, stored lines are kept as raw bytes."""
+        return [
+            self._added[id] if id in self._added else self._line(self._rows[id])
+            for id in ids
+        ]
+
+    @staticmethod
+    def write(folder: str, entries: list[bytes | Document]):
+        offsets = np.zeros((len(entries), 2), dtype=np.int64)
+        position = 0
+        with open(os.path.join(folder, DOCS_FILE), "wb") as f:
+            for row, entry in enumerate(entries):
+                line = entry if isinstance(entry, bytes) else _encode(entry)
+                f.write(line)
+                offsets[row] = (position, len(line))
+                position += len(line)
+            f.flush()
+            os.fsync(f.fileno())
+        np.save(os.path.join(folder, OFFSETS_FILE), offsets)
+
+    def _line(self, row: int) -> bytes:
+        start, length = self._offsets[row]
+        return self._mmap[start : start + length]  # type: ignore
+
+
+def _encode(doc: Document) -> bytes:
+    line = json.dumps(
+        {"content": doc.page_content, "metadata": doc.metadata},
+        ensure_ascii=False,
+        default=str,
+    )
+    return (line + "\n").encode("utf-8")
+
+
+def _decode(line: bytes) -> Document:
+    data: dict[str, Any] = json.loads(line)
+    return Document(data["content"], metadata=data["metadata"])
@@ -0,0 +1,402 @@
+import ast
+import json
+import operator
+import os
+from functools import lru_cache
+from typing import Any, Callable, Iterable
+
+import numpy as np
+
+
+class MetadataColumns:
+    """Column store of document metadata aligned with FAISS index positions.
+
+    Every metadata key is dictionary encoded: one int32 code per row pointing into
+    the list of distinct values seen for that key. Code 0 is reserved for rows
+    that do not have the key. Filters are evaluated once per distinct value and
+    then broadcast over the codes, so they never touch individual documents.
+
+    `unique_keys` name keys with a distinct string value per row, like ids.
+    Their dictionaries would only grow, so they are stored as plain byte strings
+    and codes are derived when asked for.
+    """
+
+    def __init__(self, unique_keys: Iterable[str] = ()):
+        self.size = 0
+        self._capacity = 0
+        self._codes: dict[str, np.ndarray] = {}
+        self._values: dict[str, list[Any]] = {}
+        self._lookup: dict[str, dict[Any, int]] = {}
+        self.unique_keys = frozenset(unique_keys)
+        self._unique: dict[str, np.ndarray] = {}  # b"" = missing
+
+    @staticmethod
+    def from_metadatas(
+        metadatas: Iterable[dict[str, Any]], unique_keys: Iterable[str] = ()
+    ) -> "MetadataColumns":
+        columns = MetadataColumns(unique_keys)
+        columns.append(list(metadatas))
+        return columns
+
+    def append(self, metadatas: list[dict[str, Any]]):
+        start = self.size
+        self._reserve(start + len(metadatas))
+        for row, metadata in enumerate(metadatas, start):
+            for key, value in metadata.items():
+                if key in self.unique_keys:
+                    self._set_unique(key, row, value)
+                    continue
+                column = self._column(key)
+                column[row] = self._encode(key, value)
+        self.size += len(metadatas)
+
+    def remove(self, positions: Iterable[int]):
+        positions = np.fromiter(positions, dtype=np.int64)
+        if not len(positions):
+            return
+        keep = np.ones(self.size, dtype=bool)
+        keep[positions] = False
+        for column in [*self._codes.values(), *self._unique.values()]:
+            kept = column[: self.size][keep]
+            column[: len(kept)] = kept
+            column[len(kept) :] = 0
+        self.size = int(keep.sum())
+
+    def compact(self):
+        """Drop dictionary values no row refers to any more, e.g. after removes."""
+        for key in list(self._codes):
+            codes = self._codes[key][: self.size]
+            used = np.unique(codes)
+            used = used[used != 0]
+            if len(used) == len(self._values[key]) - 1:
+                continue
+            if not len(used):
+                del self._codes[key], self._values[key], self._lookup[key]
+                continue
+            remap = np.zeros(len(self._values[key]), dtype=np.int32)
+            remap[used] = np.arange(1, len(used) + 1, dtype=np.int32)
+            codes[:] = remap[codes]
+            self._values[key] = [None] + [self._values[key][code] for code in used]
+            self._lookup[key] = {
+                _hashable(value): code
+                for code, value in enumerate(self._values[key])
+                if code
+            }
+
+    def copy(self) -> "MetadataColumns":
+        columns = MetadataColumns(self.unique_keys)
+        columns.size = self.size
+        columns._capacity = self.size
+        columns._codes = {k: v[: self.size].copy() for k, v in self._codes.items()}
+        columns._values = {k: list(v) for k, v in self._values.items()}
+        columns._lookup = {k: dict(v) for k, v in self._lookup.items()}
+        columns._unique = {k: v[: self.size].copy() for k, v in self._unique.items()}
+        return columns
+
+    def save(self, folder: str):
+        keys = list(self._codes)
+        unique = list(self._unique)
+        with open(os.path.join(folder, "columns.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "size": self.size,
+                    "keys": keys,
+                    "values": self._values,
+                    "unique": unique,
+                },
+                f,
+                ensure_ascii=False,
+                default=str,
+            )
+        np.savez(
+            os.path.join(folder, "columns.npz"),
+            *[self._codes[key][: self.size] for key in keys],
+            *[self._unique[key][: self.size] for key in unique],
+        )
+
+    @staticmethod
+    def load(folder: str, unique_keys: Iterable[str] = ()) -> "MetadataColumns":
+        with open(os.path.join(folder, "columns.json"), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        arrays = np.load(os.path.join(folder, "columns.npz"))
+        columns = MetadataColumns(unique_keys)
+        columns.size = columns._capacity = state["size"]
+        for i, key in enumerate(state["keys"]):
+            codes = arrays[f"arr_{i}"].astype(np.int32)
+            values = state["values"][key]
+            if key in columns.unique_keys:
+                # dictionary encoded by older versions
+                columns._unique[key] = np.array(
+                    [b""] + [str(value).encode("utf-8") for value in values[1:]]
+                )[codes]
+                continue
+            columns._codes[key] = codes
+            columns._values[key] = values
+            columns._lookup[key] = {
+                _hashable(value): code for code, value in enumerate(values) if code
+            }
+        for i, key in enumerate(state.get("unique", []), len(state["keys"])):
+            columns._unique[key] = arrays[f"arr_{i}"]
+        return columns
+
+    def keys(self) -> list[str]:
+        return list(self._codes) + list(self._unique)
+
+    def codes(self, key: str) -> np.ndarray:
+        if key in self._unique:
+            return self._unique_codes(key)[1]
+        if key not in self._codes:
+            return np.zeros(self.size, dtype=np.int32)
+        return self._codes[key][: self.size]
+
+    def values(self, key: str) -> list[Any]:
+        if key in self._unique:
+            return self._unique_codes(key)[0]
+        return self._values.get(key, [None])
+
+    def rows_with(self, key: str, value: Any) -> np.ndarray:
+        """Positions of the rows where `key` equals `value`."""
+        if key in self._unique:
+            return np.flatnonzero(
+                self._unique[key][: self.size] == str(value).encode("utf-8")
+            )
+        code = self._lookup.get(key, {}).get(_hashable(value))
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.codes(key) == code)
+
+    def _unique_codes(self, key: str) -> tuple[list[Any], np.ndarray]:
+        # equal values share a code, like a dictionary encoded column
+        distinct, inverse = np.unique(self._unique[key][: self.size], return_inverse=True)
+        codes = inverse.astype(np.int32) + 1
+        codes[self._unique[key][: self.size] == b""] = 0
+        return [None] + [value.decode("utf-8") for value in distinct], codes
+
+    def _set_unique(self, key: str, row: int, value: Any):
+        encoded = str(value).encode("utf-8")
+        column = self._unique.get(key)
+        if column is None:
+            column = self._unique[key] = np.zeros(self._capacity, dtype=f"S{len(encoded) or 1}")
+        elif column.dtype.itemsize < len(encoded):
+            column = self._unique[key] = column.astype(f"S{len(encoded)}")
+        column[row] = encoded
+
+    def _column(self, key: str) -> np.ndarray:
+        if key not in self._codes:
+            self._codes[key] = np.zeros(self._capacity, dtype=np.int32)
+            self._values[key] = [None]  # code 0 = missing
+            self._lookup[key] = {}
+        return self._codes[key]
+
+    def _encode(self, key: str, value: Any) -> int:
+        lookup = self._lookup[key]
+        hashable = _hashable(value)
+        code = lookup.get(hashable)
+        if code is None:
+            code = len(self._values[key])
+            self._values[key].append(value)
+            lookup[hashable] = code
+        return code
+
+    def _reserve(self, size: int):
+        if size <= self._capacity:
+            return
+        self._capacity = max(size, self._capacity * 2, 64)
+        for columns in [self._codes, self._unique]:
+            for key, column in columns.items():
+                grown = np.zeros(self._capacity, dtype=column.dtype)
+                grown[: len(column)] = column
+                columns[key] = grown
+
+
+class Filter:
+    """Metadata filter expression compiled into a vectorized predicate.
+
+    Accepts the same syntax the memory filters always used, like
+    `area == 'main' or area == 'fragments'`, but only a safe subset of Python:
+    metadata names, literals, comparisons, `in`, `and`, `or` and `not`.
+
+    Matches what evaluating the expression per document used to: a document
+    does not match where evaluation would fail, e.g. on a metadata key it does
+    not have, and an invalid or unsupported expression matches nothing.
+    """
+
+    def __init__(self, condition: str):
+        self.condition = condition
+        try:
+            self._tree: ast.Expression | None = ast.parse(condition.strip(), mode="eval")
+            self._evaluate = _compile(self._tree.body)
+        except Exception as e:
+            print(f"Invalid memory filter '{condition}', nothing matches: {e}")
+            self._tree = None
+            self._evaluate = lambda columns: (False, True)
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        """Boolean mask over index positions matching the filter."""
+        result, error = self._evaluate(columns)
+        mask = np.logical_and(result, np.logical_not(error))
+        return np.broadcast_to(mask, (columns.size,)).copy()
+
+    def matches(self, metadata: dict[str, Any]) -> bool:
+        return bool(self.mask(MetadataColumns.from_metadatas([metadata]))[0])
+
+    def values_of(self, key: str) -> set[Any] | None:
+        """Values `key` is restricted to by the filter, None if it can take any."""
+        if self._tree is None:
+            return set()
+        return _values_of(self._tree.body, key)
+
+
+@lru_cache(maxsize=256)
+def compile_filter(condition: str) -> Filter:
+    return Filter(condition)
+
+
+_COMPARE: dict[type, Callable[[Any, Any], bool]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+# an evaluator returns two masks (or scalars): the result per row and where
+# evaluating it failed, which makes the row not match
+Evaluator = Callable[[MetadataColumns], tuple[Any, Any]]
+
+
+def _compile(node: ast.AST) -> Evaluator:
+    if isinstance(node, ast.BoolOp):
+        return _short_circuit(
+            [_compile(value) for value in node.values], isinstance(node.op, ast.And)
+        )
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        part = _compile(node.operand)
+
+        def negate(columns: MetadataColumns):
+            result, error = part(columns)
+            return np.logical_not(result), error
+
+        return negate
+
+    if isinstance(node, ast.Compare):
+        # a < b < c compares pairwise like a < b and b < c
+        operands = [node.left, *node.comparators]
+        return _short_circuit(
+            [
+                _compile_compare(operands[i], op, operands[i + 1])
+                for i, op in enumerate(node.ops)
+            ],
+            True,
+        )
+
+    if isinstance(node, ast.Name):
+        return _column_predicate(node.id, bool)
+
+    if _is_literal(node):
+        value = ast.literal_eval(node)
+        return lambda columns: (bool(value), False)
+
+    raise ValueError(f"Unsupported memory filter expression: {ast.unparse(node)}")
+
+
+def _compile_compare(left: ast.AST, op: ast.cmpop, right: ast.AST) -> Evaluator:
+    if type(op) not in _COMPARE:
+        raise ValueError(f"Unsupported memory filter operator: {type(op).__name__}")
+    compare = _COMPARE[type(op)]
+
+    if isinstance(left, ast.Name) and _is_literal(right):
+        value = ast.literal_eval(right)
+        return _column_predicate(left.id, lambda v: compare(v, value))
+    if _is_literal(left) and isinstance(right, ast.Name):
+        value = ast.literal_eval(left)
+        return _column_predicate(right.id, lambda v: compare(value, v))
+    if _is_literal(left) and _is_literal(right):
+        result = compare(ast.literal_eval(left), ast.literal_eval(right))
+        return lambda columns: (bool(result), False)
+
+    raise ValueError(
+        f"Unsupported memory filter comparison: {ast.unparse(left)} {type(op).__name__} {ast.unparse(right)}"
+    )
+
+
+def _values_of(node: ast.AST, key: str) -> set[Any] | None:
+    if isinstance(node, ast.BoolOp):
+        parts = [_values_of(value, key) for value in node.values]
+        if isinstance(node.op, ast.Or):
+            if any(part is None for part in parts):
+                return None
+            return set().union(*parts)  # type: ignore
+        known = [part for part in parts if part is not None]
+        return set.intersection(*known) if known else None
+
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        left, op, right = node.left, node.ops[0], node.comparators[0]
+        if isinstance(right, ast.Name) and isinstance(op, ast.Eq):
+            left, right = right, left
+        if not (isinstance(left, ast.Name) and left.id == key and _is_literal(right)):
+            return None
+        value = ast.literal_eval(right)
+        if isinstance(op, ast.Eq):
+            return {value}
+        if isinstance(op, ast.In) and isinstance(value, (list, tuple, set)):
+            return set(value)
+
+    return None
+
+
+def _short_circuit(parts: list[Evaluator], is_and: bool) -> Evaluator:
+    def evaluate(columns: MetadataColumns):
+        result, error = parts[0](columns)
+        for part in parts[1:]:
+            # later operands only count where the earlier ones did not decide
+            decided = result if not is_and else np.logical_not(result)
+            pending = np.logical_not(np.logical_or(error, decided))
+            value, failed = part(columns)
+            error = np.logical_or(error, np.logical_and(pending, failed))
+            result = np.where(pending, value, result)
+        return result, error
+
+    return evaluate
+
+
+def _column_predicate(key: str, test: Callable[[Any], Any]) -> Evaluator:
+    def evaluate(columns: MetadataColumns):
+        # test each distinct value once, then broadcast over the rows
+        outcomes = [_safe(test, value) for value in columns.values(key)]
+        result = np.array([outcome for outcome, _ in outcomes], dtype=bool)
+        error = np.array([failed for _, failed in outcomes], dtype=bool)
+        error[0] = True  # code 0, the row does not have the key
+        codes = columns.codes(key)
+        return result[codes], error[codes]
+
+    return evaluate
+
+
+def _safe(test: Callable[[Any], Any], value: Any) -> tuple[bool, bool]:
+    try:
+        return bool(test(value)), False
+    except Exception:
+        return False, True  # e.g. ordering a number against a string
+
+
+def _is_literal(node: ast.AST) -> bool:
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return all(isinstance(e, ast.Constant) for e in node.elts)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return isinstance(node.operand, ast.Constant)
+    return False
+
+
+def _hashable(value: Any) -> Any:
+    try:
+        hash(value)
+        return (type(value).__name__, value)
+    except TypeError:
+        return (type(value).__name__, repr(value))
@@ -0,0 +1,333 @@
+import math
+from typing import Any
+
+import faiss
+import numpy as np
+
+# supported values of AgentConfig.memory_index_type
+FLAT = "flat"
+HNSW = "hnsw"
+IVF_FLAT = "ivf_flat"
+IVF_PQ = "ivf_pq"
+SQ8 = "sq8"
+FP16 = "fp16"
+INDEX_TYPES = [FLAT, HNSW, IVF_FLAT, IVF_PQ, SQ8, FP16]
+
+# compressed types that can re-rank their candidates against finer vectors
+RERANK_TYPES = [IVF_PQ, SQ8, FP16]
+RERANK = "+rerank"  # suffix of index_type_of for re-ranked indexes
+
+# defaults for AgentConfig.memory_index_params
+DEFAULT_PARAMS: dict[str, Any] = {
+    "hnsw_m": 32,  # graph neighbours per node
+    "ef_construction": 40,
+    "ef_search": 64,
+    "nlist": 0,  # IVF cells, 0 = 4 * sqrt(n)
+    "nprobe": 16,  # IVF cells visited per query
+    "pq_m": 0,  # PQ sub-quantizers, 0 = largest divisor of dim up to dim / 8
+    "pq_bits": 8,
+    "rerank": 0,  # candidates per result re-scored on finer vectors, 0 = off
+    "rerank_storage": FP16,  # vectors kept for re-ranking, fp16 or flat (float32, exact)
+}
+
+
+def params_with_defaults(params: dict[str, Any] | None) -> dict[str, Any]:
+    return {**DEFAULT_PARAMS, **(params or {})}
+
+
+def index_type_of(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexRefine):
+        return index_type_of(faiss.downcast_index(index.base_index)) + RERANK
+    if isinstance(index, faiss.IndexHNSW):
+        return HNSW
+    if isinstance(index, faiss.IndexIVFPQ):
+        return IVF_PQ
+    if isinstance(index, faiss.IndexIVFFlat):
+        return IVF_FLAT
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return FP16 if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else SQ8
+    return FLAT
+
+
+def target_type(index_type: str, params: dict[str, Any] | None = None) -> str:
+    """What index_type_of reports for an index created with these settings."""
+    if params_with_defaults(params)["rerank"] and index_type in RERANK_TYPES:
+        return index_type + RERANK
+    return index_type
+
+
+# vectors an SQ8 index needs to estimate the value range of every dimension
+SQ8_MIN_TRAIN = 1000
+# a trained index is retrained once it holds this many times the vectors it was trained on
+RETRAIN_GROWTH = 4
+
+
+def needs_training(index_type: str) -> bool:
+    return index_type in [IVF_FLAT, IVF_PQ, SQ8]
+
+
+def min_train_size(index_type: str, params: dict[str, Any], n: int) -> int:
+    # faiss warns below ~39 points per centroid, stay flat until there is enough data
+    if index_type in [IVF_FLAT, IVF_PQ]:
+        nlist = _nlist(params, n)
+        size = nlist * 39
+        if index_type == IVF_PQ:
+            size = max(size, 2 ** params["pq_bits"] * 39)
+        return size
+    if index_type == SQ8:
+        return SQ8_MIN_TRAIN
+    return 0
+
+
+def create_index(
+    dim: int, index_type: str, params: dict[str, Any] | None = None, n: int = 0
+) -> faiss.Index:
+    """Create an empty inner-product index of the given type, `n` sizes IVF cells."""
+    params = params_with_defaults(params)
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == HNSW:
+        index = faiss.IndexHNSWFlat(dim, params["hnsw_m"], metric)
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif index_type == IVF_FLAT:
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, _nlist(params, n), metric)
+    elif index_type == IVF_PQ:
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatIP(dim),
+            dim,
+            _nlist(params, n),
+            _pq_m(params, dim),
+            params["pq_bits"],
+            metric,
+        )
+    elif index_type == SQ8:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, metric)
+    elif index_type == FP16:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, metric)
+    elif index_type == FLAT:
+        index = faiss.IndexFlatIP(dim)
+    else:
+        raise ValueError(
+            f"Unknown memory index type '{index_type}', use one of {INDEX_TYPES}"
+        )
+    if params["rerank"] and index_type in RERANK_TYPES:
+        # search the compressed codes, then re-score the top candidates
+        if params["rerank_storage"] == FLAT:
+            refine = faiss.IndexFlatIP(dim)
+        else:
+            refine = faiss.IndexScalarQuantizer(
+                dim, faiss.ScalarQuantizer.QT_fp16, metric
+            )
+        index = faiss.IndexRefine(index, refine)
+    set_search_params(index, params)
+    return index
+
+
+def set_search_params(index: faiss.Index, params: dict[str, Any] | None = None):
+    params = params_with_defaults(params)
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = params["rerank"] or index.k_factor
+        set_search_params(faiss.downcast_index(index.base_index), params)
+        return
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["ef_search"]
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf:
+        ivf.nprobe = params["nprobe"]
+        if ivf.direct_map.no():
+            ivf.make_direct_map()  # reconstruct single results, e.g. for diversity ranking
+
+
+def search(
+    index: faiss.Index, vectors: np.ndarray, k: int, mask: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Search `index`, restricted to the positions set in `mask` if given.
+
+    The mask is passed to faiss as an ID selector so filtering happens inside the
+    search. Small selections on non-IVF indexes are scored exactly instead, an
+    approximate graph walk easily misses them.
+    """
+    if mask is None:
+        return index.search(vectors, k)
+    ids = np.flatnonzero(mask).astype(np.int64)
+    if len(ids) <= EXACT_SEARCH_LIMIT and not faiss.try_extract_index_ivf(index):
+        return _search_exact(index, vectors, k, ids)
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    return index.search(vectors, k, params=_search_parameters(index, selector))
+
+
+def range_search(
+    index: faiss.Index, vector: np.ndarray, radius: float, mask: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Positions and scores of every vector scoring at least `radius` against `vector`."""
+    if isinstance(index, faiss.IndexRefine):
+        return _range_search_exact(index, vector, radius, mask)
+    params = None
+    if mask is not None:
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        params = _search_parameters(index, selector)
+    # faiss keeps scores strictly above the radius for inner product
+    _, scores, labels = index.range_search(
+        vector.reshape(1, -1), float(np.nextafter(radius, -np.inf)), params=params
+    )
+    keep = scores >= radius
+    return labels[keep], scores[keep]
+
+
+def _range_search_exact(
+    index: faiss.Index,
+    vector: np.ndarray,
+    radius: float,
+    mask: np.ndarray | None,
+    batch: int = 4096,
+) -> tuple[np.ndarray, np.ndarray]:
+    # re-ranked indexes have no range search, score their finer vectors directly
+    ids = np.flatnonzero(mask) if mask is not None else np.arange(index.ntotal)
+    labels, scores = [], []
+    for start in range(0, len(ids), batch):
+        chunk = ids[start : start + batch].astype(np.int64)
+        similarities = index.reconstruct_batch(chunk) @ vector
+        keep = similarities >= radius
+        labels.append(chunk[keep])
+        scores.append(similarities[keep])
+    if not labels:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(labels), np.concatenate(scores)
+
+
+# selections up to this size are scored exactly by reconstructing their vectors
+EXACT_SEARCH_LIMIT = 2048
+
+
+def _search_exact(
+    index: faiss.Index, vectors: np.ndarray, k: int, ids: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    scores = np.full((len(vectors), k), -np.inf, dtype=np.float32)
+    labels = np.full((len(vectors), k), -1, dtype=np.int64)
+    if not len(ids):
+        return scores, labels
+    similarities = vectors @ index.reconstruct_batch(ids).T
+    top = min(k, len(ids))
+    order = np.argsort(-similarities, axis=1)[:, :top]
+    scores[:, :top] = np.take_along_axis(similarities, order, axis=1)
+    labels[:, :top] = ids[order]
+    return scores, labels
+
+
+def _search_parameters(index: faiss.Index, selector) -> faiss.SearchParameters:
+    # explicit parameters replace the index defaults, carry them over
+    if isinstance(index, faiss.IndexRefine):
+        return faiss.IndexRefineSearchParameters(
+            k_factor=index.k_factor,
+            base_index_params=_search_parameters(
+                faiss.downcast_index(index.base_index), selector
+            ),
+        )
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build(
+    vectors: np.ndarray, index_type: str, params: dict[str, Any] | None = None
+) -> faiss.Index:
+    index = create_index(vectors.shape[1], index_type, params, n=len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    # flat codes compact positions on remove_ids like the docstore mapping expects,
+    # IVF keeps the original ids and HNSW cannot remove at all
+    return isinstance(index, faiss.IndexFlatCodes)
+
+
+def rebuild_without(index: faiss.Index, positions: set[int]) -> faiss.Index:
+    keep = np.ones(index.ntotal, dtype=bool)
+    keep[list(positions)] = False
+    vectors = reconstruct_all(index)[keep]
+    new = faiss.clone_index(index)  # keeps trained quantizers and parameters
+    new.reset()
+    new.add(vectors)
+    return new
+
+
+def can_migrate(
+    current_type: str,
+    n: int,
+    index_type: str,
+    params: dict[str, Any] | None = None,
+    trained_on: int = 0,
+) -> bool:
+    """Whether an index of `current_type` with `n` vectors should be rebuilt as `index_type`.
+
+    False if there are not enough vectors to train it yet, or it already has that
+    type and holds less than RETRAIN_GROWTH times the `trained_on` vectors it was
+    trained on, 0 if unknown.
+    """
+    if needs_training(index_type) and n < min_train_size(
+        index_type, params_with_defaults(params), n
+    ):
+        return False
+    if current_type == target_type(index_type, params):
+        # quantizers and IVF cells trained on a small sample fit the grown data poorly
+        return needs_training(index_type) and n >= RETRAIN_GROWTH * trained_on
+    return True
+
+
+def footprint(index: faiss.Index) -> int:
+    return len(faiss.serialize_index(index))
+
+
+def recall_at_k(
+    index: faiss.Index, vectors: np.ndarray, k: int = 10, queries: int = 100
+) -> float:
+    """Share of the exact top-k neighbours found by `index`, sampled over its own vectors."""
+    if len(vectors) == 0:
+        return 1.0
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)]
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    _, exact = flat.search(sample, k)
+    _, approx = index.search(sample, k)
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact, approx))
+    return hits / (len(sample) * k)
+
+
+def report(index: faiss.Index, vectors: np.ndarray, k: int = 10) -> dict[str, Any]:
+    flat_bytes = vectors.nbytes
+    size = footprint(index)
+    return {
+        "type": index_type_of(index),
+        "vectors": index.ntotal,
+        "bytes": size,
+        "flat_bytes": flat_bytes,
+        "compression": round(flat_bytes / size, 2) if size else 0,
+        f"recall@{k}": round(recall_at_k(index, vectors, k), 4),
+    }
+
+
+def _nlist(params: dict[str, Any], n: int) -> int:
+    if params["nlist"]:
+        return params["nlist"]
+    return max(1, int(4 * math.sqrt(max(n, 1))))
+
+
+def _pq_m(params: dict[str, Any], dim: int) -> int:
+    if params["pq_m"]:
+        return params["pq_m"]
+    return max(m for m in range(1, max(1, dim // 8) + 1) if dim % m == 0)
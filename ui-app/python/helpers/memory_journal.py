@@ -0,0 +1,188 @@
+import base64
+import json
+import os
+import threading
+from typing import Any, Callable, Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+class MemoryJournal:
+    """Append-only log of inserts and deletes applied on top of the last FAISS snapshot.
+
+    Every operation is written as one JSON line and fsynced before the call returns,
+    so the full index only has to be rewritten on compaction instead of on every insert.
+    """
+
+    FILE = "journal.jsonl"
+    COMPACTING = "journal.compacting.jsonl"
+
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self.path = os.path.join(db_dir, MemoryJournal.FILE)
+        self.compacting_path = os.path.join(db_dir, MemoryJournal.COMPACTING)
+        self._terminate_torn_line()
+        self.ops = sum(1 for _ in self._read(self.path))
+        self._compaction: threading.Thread | None = None
+        # how far the live journal has been applied, to catch up on other processes
+        self.position = 0
+        self._inode = 0
+
+    def append_insert(self, docs: list[Document], vectors: list[list[float]]):
+        self._append(
+            {
+                "op": "insert",
+                "docs": [
+                    {
+                        "id": doc.metadata["id"],
+                        "content": doc.page_content,
+                        "metadata": doc.metadata,
+                        "vector": _encode_vector(vector),
+                    }
+                    for doc, vector in zip(docs, vectors)
+                ],
+            }
+        )
+
+    def append_delete(self, ids: list[str]):
+        self._append({"op": "delete", "ids": list(ids)})
+
+    def _append(self, record: dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with open(self.path, "ab") as f:
+            f.write((line + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            self.position = f.tell()
+            self._inode = os.fstat(f.fileno()).st_ino
+        self.ops += 1
+
+    def replay(
+        self,
+        insert: Callable[[list[Document], list[list[float]]], Any],
+        delete: Callable[[list[str]], Any],
+    ) -> int:
+        # a journal still being compacted holds older operations than the live one
+        count = self._apply(self.compacting_path, 0, insert, delete)
+        self.position = 0
+        self._inode = self._live_inode()
+        count += self._apply(self.path, 0, insert, delete)
+        return count
+
+    def replay_new(
+        self,
+        insert: Callable[[list[Document], list[list[float]]], Any],
+        delete: Callable[[list[str]], Any],
+    ) -> bool:
+        """Apply operations appended by another process since the last replay.
+
+        Returns False if the journal was compacted meanwhile and the snapshot
+        has to be reloaded instead.
+        """
+        inode = self._live_inode()
+        if self._inode and inode != self._inode:
+            return False
+        self._inode = inode
+        self._apply(self.path, self.position, insert, delete)
+        return True
+
+    def _apply(
+        self,
+        path: str,
+        start: int,
+        insert: Callable[[list[Document], list[list[float]]], Any],
+        delete: Callable[[list[str]], Any],
+    ) -> int:
+        count = 0
+        for record, end in self._read(path, start):
+            if record.get("op") == "insert":
+                docs = [
+                    Document(d["content"], metadata=d["metadata"])
+                    for d in record["docs"]
+                ]
+                vectors = [_decode_vector(d["vector"]) for d in record["docs"]]
+                insert(docs, vectors)
+            elif record.get("op") == "delete":
+                delete(record["ids"])
+            if path == self.path:
+                self.position = end
+            count += 1
+        return count
+
+    def _terminate_torn_line(self):
+        # a crash mid-append leaves a partial line, new records must not be glued to it
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def _live_inode(self) -> int:
+        return os.stat(self.path).st_ino if os.path.exists(self.path) else 0
+
+    def is_compacting(self) -> bool:
+        return self._compaction is not None and self._compaction.is_alive()
+
+    def compact(self, write_snapshot: Callable[[], Callable[[], None]]):
+        """Fold the journal into a new snapshot.
+
+        `write_snapshot` is called synchronously to capture the current state and must
+        return a function that persists it; that function runs on a background thread.
+        The live journal is rotated first so new operations keep appending meanwhile.
+        """
+        if self.is_compacting():
+            return False
+        if os.path.exists(self.compacting_path):
+            # leftover of an interrupted compaction, already replayed - fold live ops into it
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as src, open(self.compacting_path, "ab") as dst:
+                    dst.write(b"\n" + src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.path)
+        elif os.path.exists(self.path):
+            os.replace(self.path, self.compacting_path)
+        self.ops = 0
+        self.position = 0
+        self._inode = 0
+        persist = write_snapshot()
+
+        def run():
+            persist()
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+
+        self._compaction = threading.Thread(target=run, daemon=True)
+        self._compaction.start()
+        return True
+
+    def wait(self):
+        if self._compaction:
+            self._compaction.join()
+
+    @staticmethod
+    def _read(path: str, start: int = 0) -> Iterator[tuple[dict[str, Any], int]]:
+        """Yield complete records with the offset right after each of them."""
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            position = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return  # still being written by another process
+                position += len(line)
+                try:
+                    yield json.loads(line), position
+                except json.JSONDecodeError:
+                    continue  # torn write from a crash, skip it
+
+
+def _encode_vector(vector: list[float]) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+
+
+def _decode_vector(data: str) -> list[float]:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).tolist()
@@ -0,0 +1,132 @@
+import math
+import re
+from collections import Counter
+from typing import Iterable
+
+from langchain_core.documents import Document
+
+# words plus compound identifiers like hostnames, paths, error codes and dotted names
+_TOKEN = re.compile(r"\w+(?:[.\-:/]\w+)*")
+_PARTS = re.compile(r"[.\-:/_]")
+
+# query words that match nearly every document and say nothing about the topic
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in is it "
+    "its me my no not of on or our so that the their then there these this to "
+    "was we were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased tokens, compound identifiers also yield their parts."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = [part for part in _PARTS.split(token) if part]
+        if len(parts) > 1:
+            tokens += parts
+    return tokens
+
+
+class LexicalIndex:
+    """Incremental BM25 inverted index over document ids.
+
+    Complements vector search for exact terms like error codes, hostnames and
+    function names, which embeddings tend to blur.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, int]] = {}
+        self._lengths: dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        for id, text in zip(ids, texts):
+            if id in self._lengths:
+                self.remove([id])
+            tokens = tokenize(text)
+            for term, count in Counter(tokens).items():
+                self._postings.setdefault(term, {})[id] = count
+            self._lengths[id] = len(tokens)
+            self._total_length += len(tokens)
+
+    def remove(self, ids: Iterable[str], texts: Iterable[str] | None = None):
+        """Remove documents, `texts` avoids scanning every posting list."""
+        ids = [id for id in ids if id in self._lengths]
+        if not ids:
+            return
+        if texts is None:
+            removed = set(ids)
+            terms = [
+                term
+                for term, postings in self._postings.items()
+                if not removed.isdisjoint(postings)
+            ]
+            for term in terms:
+                self._drop(term, removed)
+        else:
+            for id, text in zip(ids, texts):
+                for term in set(tokenize(text)):
+                    self._drop(term, {id})
+        for id in ids:
+            self._total_length -= self._lengths.pop(id)
+
+    def search(
+        self, query: str, limit: int = 0, min_match: float = 0.0
+    ) -> list[tuple[str, float]]:
+        """Document ids matching any query term with their BM25 score, best first.
+
+        Stopwords in the query are ignored. `min_match` drops documents scoring
+        below that share of the summed idf of the query terms, about what a
+        document of average length containing each term once scores. Terms no
+        document contains count with the highest idf.
+        """
+        n = len(self._lengths)
+        terms = {term for term in tokenize(query) if term not in STOPWORDS}
+        if not n or not terms:
+            return []
+        average = self._total_length / n or 1
+        scores: Counter[str] = Counter()
+        weight = 0.0
+        for term in terms:
+            postings = self._postings.get(term, {})
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            weight += idf
+            for id, count in postings.items():
+                norm = LexicalIndex.K1 * (
+                    1 - LexicalIndex.B + LexicalIndex.B * self._lengths[id] / average
+                )
+                scores[id] += idf * count * (LexicalIndex.K1 + 1) / (count + norm)
+        ranked = scores.most_common()
+        if min_match:
+            ranked = [(id, score) for id, score in ranked if score >= min_match * weight]
+        return ranked[:limit] if limit else ranked
+
+    def _drop(self, term: str, ids: set[str]):
+        postings = self._postings.get(term)
+        if postings is None:
+            return
+        for id in ids:
+            postings.pop(id, None)
+        if not postings:
+            del self._postings[term]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Document]], limit: int, k: int = 60
+) -> list[Document]:
+    """Merge ranked result lists by summing 1 / (k + rank) per document id."""
+    scores: Counter[str] = Counter()
+    docs: dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            id = doc.metadata["id"]
+            scores[id] += 1 / (k + rank)
+            docs.setdefault(id, doc)
+    return [docs[id] for id, _ in scores.most_common(limit)]
@@ -0,0 +1,69 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain_core.documents import Document
+
+CANDIDATES = 4  # candidates fetched per recalled result, times the limit
+
+
+@dataclass
+class Recall:
+    docs: list[Document] = field(default_factory=list)
+    tokens: int = 0  # tokens of the selected documents
+    tokens_saved: int = 0  # against the plain top results
+
+
+def approximate_tokens(text: str) -> int:
+    return int(len(text) / 4)  # same estimate as the rate limiter
+
+
+def select(
+    candidates: list[tuple[Document, float, np.ndarray]],
+    query: np.ndarray,
+    limit: int,
+    token_budget: int = 0,
+    mmr_lambda: float = 1.0,
+) -> Recall:
+    """Pick up to `limit` candidates by maximal marginal relevance within a token budget.
+
+    Each step takes the candidate maximizing
+    `mmr_lambda * similarity to the query - (1 - mmr_lambda) * max similarity to
+    the already selected ones`, skipping candidates that no longer fit the budget.
+    """
+    if not candidates:
+        return Recall()
+    docs = [doc for doc, _, _ in candidates]
+    tokens = [approximate_tokens(doc.page_content) for doc in docs]
+    vectors = _normalize(np.stack([vector for _, _, vector in candidates]))
+    relevance = vectors @ _normalize(query.reshape(1, -1))[0]
+    similarity = vectors @ vectors.T
+
+    selected: list[int] = []
+    remaining = list(range(len(docs)))
+    budget = token_budget or sum(tokens)
+    redundancy = np.full(len(docs), -np.inf)
+    while remaining and len(selected) < limit:
+        fitting = [i for i in remaining if tokens[i] <= budget]
+        if not fitting:
+            break
+        scores = mmr_lambda * relevance[fitting] - (1 - mmr_lambda) * np.maximum(
+            redundancy[fitting], 0
+        )
+        best = fitting[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+        budget -= tokens[best]
+        redundancy = np.maximum(redundancy, similarity[best])
+
+    used = sum(tokens[i] for i in selected)
+    plain = sum(tokens[:limit])  # what the top results by relevance would have cost
+    return Recall(
+        docs=[docs[i] for i in selected],
+        tokens=used,
+        tokens_saved=max(0, plain - used),
+    )
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
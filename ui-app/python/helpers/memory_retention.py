@@ -0,0 +1,130 @@
+import os
+import time
+from datetime import datetime
+from typing import Any, Iterable
+
+import numpy as np
+
+from python.helpers.memory_filter import MetadataColumns
+
+# values of the "evict" policy key, which memories go first once an area is over max_items
+OLDEST = "oldest"  # by insertion
+LRU = "lru"  # least recently recalled
+LFU = "lfu"  # least often recalled
+
+
+class AccessStats:
+    """How often and when each memory was last recalled, aligned with index positions.
+
+    Rows start with the insertion time as last use. Searches update the rows they
+    return without taking the write lock, so concurrent counts may be lost; the
+    numbers only rank memories for eviction.
+    """
+
+    FILE = "access.npz"
+
+    def __init__(self, size: int = 0, now: float | None = None):
+        self.recalls = np.zeros(size, dtype=np.int32)
+        self.last_used = np.full(size, now or time.time(), dtype=np.float64)
+
+    def append(self, count: int, now: float | None = None):
+        self.recalls = np.concatenate([self.recalls, np.zeros(count, dtype=np.int32)])
+        self.last_used = np.concatenate(
+            [self.last_used, np.full(count, now or time.time(), dtype=np.float64)]
+        )
+
+    def remove(self, positions: Iterable[int]):
+        positions = np.fromiter(positions, dtype=np.int64)
+        if len(positions):
+            self.recalls = np.delete(self.recalls, positions)
+            self.last_used = np.delete(self.last_used, positions)
+
+    def touch(self, positions: np.ndarray, now: float | None = None):
+        positions = positions[(positions >= 0) & (positions < len(self.recalls))]
+        np.add.at(self.recalls, positions, 1)
+        self.last_used[positions] = now or time.time()
+
+    def copy(self) -> "AccessStats":
+        stats = AccessStats()
+        stats.recalls = self.recalls.copy()
+        stats.last_used = self.last_used.copy()
+        return stats
+
+    def save(self, folder: str):
+        np.savez(
+            os.path.join(folder, AccessStats.FILE),
+            recalls=self.recalls,
+            last_used=self.last_used,
+        )
+
+    @staticmethod
+    def load(folder: str, size: int) -> "AccessStats":
+        path = os.path.join(folder, AccessStats.FILE)
+        if not os.path.exists(path):
+            return AccessStats(size)
+        data = np.load(path)
+        stats = AccessStats()
+        stats.recalls = data["recalls"]
+        stats.last_used = data["last_used"]
+        return stats
+
+
+def expired(
+    policy: dict[str, Any],
+    columns: MetadataColumns,
+    stats: AccessStats,
+    now: float | None = None,
+    exclude: np.ndarray | None = None,
+) -> np.ndarray:
+    """Positions an area retention policy removes, never those set in `exclude`.
+
+    Policy keys, all optional:
+    - max_age_days: age by the timestamp metadata
+    - max_idle_days: time since the last recall, or the insertion if never recalled
+    - max_items: what is left over this is evicted in the order of "evict",
+      one of oldest, lru or lfu (default lru)
+    """
+    now = now or time.time()
+    n = columns.size
+    remove = np.zeros(n, dtype=bool)
+    kept = np.ones(n, dtype=bool) if exclude is None else ~exclude[:n]
+
+    if policy.get("max_age_days"):
+        created = _timestamps(columns)
+        remove |= created < now - policy["max_age_days"] * 86400
+
+    if policy.get("max_idle_days"):
+        remove |= stats.last_used[:n] < now - policy["max_idle_days"] * 86400
+
+    max_items = policy.get("max_items")
+    remove &= kept
+    if max_items is not None and (kept & ~remove).sum() > max_items:
+        evict = policy.get("evict", LRU)
+        if evict == OLDEST:
+            order = np.argsort(_timestamps(columns), kind="stable")
+        elif evict == LFU:
+            order = np.lexsort((stats.last_used[:n], stats.recalls[:n]))
+        elif evict == LRU:
+            order = np.argsort(stats.last_used[:n], kind="stable")
+        else:
+            raise ValueError(f"Unknown memory eviction order '{evict}', use {OLDEST}, {LRU} or {LFU}")
+        order = order[kept[order] & ~remove[order]]
+        remove[order[: len(order) - max_items]] = True
+
+    return np.flatnonzero(remove)
+
+
+def _timestamps(columns: MetadataColumns) -> np.ndarray:
+    # parse every distinct timestamp once, then broadcast over the rows
+    values = np.array(
+        [_parse_timestamp(value) for value in columns.values("timestamp")],
+        dtype=np.float64,
+    )
+    return values[columns.codes("timestamp")]
+
+
+def _parse_timestamp(value: Any) -> float:
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return np.inf  # missing or unknown format, never expires by age
@@ -0,0 +1,76 @@
+import hashlib
+from collections import deque
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+# values of AgentConfig.prompt_layout
+CLASSIC = "classic"  # everything in the system message
+CACHED = "cached"  # stable system message, volatile parts after the history
+
+
+def with_suffix(messages: list[BaseMessage], suffix: str) -> list[BaseMessage]:
+    """The messages with `suffix` added to the last human message, or as a new one.
+
+    Only the last message differs from what the next call will send, so the
+    system message and every earlier message stay a reusable prefix.
+    """
+    if not suffix:
+        return messages
+    if messages and messages[-1].type == "human":
+        last = messages[-1]
+        return messages[:-1] + [HumanMessage(content=f"{last.content}\n\n{suffix}")]
+    return messages + [HumanMessage(content=suffix)]
+
+
+class PrefixStats:
+    """How often a model call starts with the full prefix of the previous call, and time to first token.
+
+    The prefix of a call is its system message and all messages but the last,
+    compared by hash per agent. A hit means a provider prompt or KV cache could
+    reuse everything it processed for the previous call.
+    """
+
+    WINDOW = 100  # recent calls the averages cover
+
+    def __init__(self):
+        self._prefixes: dict[int, list[bytes]] = {}
+        self.calls = 0
+        self.hits = 0
+        self._ttft: dict[bool, deque] = {
+            True: deque(maxlen=PrefixStats.WINDOW),
+            False: deque(maxlen=PrefixStats.WINDOW),
+        }
+
+    def start(self, agent_number: int, system: str, messages: list[BaseMessage]) -> bool:
+        """Record a call and return whether its prefix extends the previous one."""
+        hashes = [_hash("system", system)] + [
+            _hash(message.type, str(message.content)) for message in messages
+        ]
+        previous = self._prefixes.get(agent_number)
+        hit = previous is not None and hashes[: len(previous)] == previous
+        self._prefixes[agent_number] = hashes[:-1] if len(hashes) > 1 else hashes
+        self.calls += 1
+        self.hits += hit
+        return hit
+
+    def first_token(self, hit: bool, seconds: float):
+        self._ttft[hit].append(seconds)
+
+    def stats(self) -> dict[str, float | int | None]:
+        return {
+            "calls": self.calls,
+            "prefix_hits": self.hits,
+            "hit_ratio": round(self.hits / self.calls, 3) if self.calls else None,
+            "ttft_hit": _average(self._ttft[True]),
+            "ttft_miss": _average(self._ttft[False]),
+        }
+
+
+def _hash(type: str, content: str) -> bytes:
+    return hashlib.blake2b(
+        f"{type}\0{content}".encode("utf-8"), digest_size=16
+    ).digest()
+
+
+def _average(values: deque) -> float | None:
+    return round(sum(values) / len(values), 3) if values else None
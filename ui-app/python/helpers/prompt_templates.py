@@ -0,0 +1,112 @@
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+from python.helpers import files
+
+# {{ include 'path' }} or a {{placeholder}}
+_PARTS = re.compile(r"{{\s*include\s*['\"](.*?)['\"]\s*}}|{{(\w+)}}")
+
+CHECK_INTERVAL = 1.0  # seconds between modification time checks of a template
+
+
+@dataclass
+class Template:
+    """A prompt file parsed once, includes inlined.
+
+    `segments` alternate literal text and placeholder names, so rendering is a
+    single join. `files` holds the modification time of every file read, None
+    for a location that did not exist yet but would take precedence.
+    """
+
+    segments: list[str] = field(default_factory=list)  # text at even, names at odd positions
+    files: dict[str, int | None] = field(default_factory=dict)
+    checked: float = 0.0
+
+    def render(self, **kwargs) -> str:
+        values = {key: str(value) for key, value in kwargs.items()}
+        return "".join(
+            segment if i % 2 == 0 else values.get(segment, "{{" + segment + "}}")
+            for i, segment in enumerate(self.segments)
+        )
+
+    def outdated(self) -> bool:
+        return any(_mtime(path) != mtime for path, mtime in self.files.items())
+
+
+_cache: dict[tuple[str, tuple[str, ...]], Template] = {}
+_lock = threading.Lock()
+
+
+def render(relative_path: str, backup_dirs: list[str] | None = None, **kwargs) -> str:
+    """Cached equivalent of `files.read_file`, recompiled when a file it read changes."""
+    return get(relative_path, backup_dirs).render(**kwargs)
+
+
+def get(relative_path: str, backup_dirs: list[str] | None = None) -> Template:
+    key = (relative_path, tuple(backup_dirs or []))
+    template = _cache.get(key)
+    now = time.monotonic()
+    if template and now - template.checked < CHECK_INTERVAL:
+        return template
+    if template and not template.outdated():
+        template.checked = now
+        return template
+    template = load(relative_path, list(key[1]))
+    template.checked = now
+    with _lock:
+        _cache[key] = template
+    return template
+
+
+def load(relative_path: str, backup_dirs: list[str]) -> Template:
+    template = Template()
+    _compile(relative_path, backup_dirs, template)
+    return template
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _compile(relative_path: str, backup_dirs: list[str], template: Template):
+    primary = files.get_abs_path(relative_path)
+    absolute_path = files.find_file_in_dirs(relative_path, backup_dirs)
+    template.files[primary] = _mtime(primary)
+    template.files[absolute_path] = _mtime(absolute_path)
+
+    with open(absolute_path, "r", encoding="utf-8") as f:
+        content = files.remove_code_fences(f.read())
+
+    position = 0
+    for match in _PARTS.finditer(content):
+        _append_text(template, content[position : match.start()])
+        include, name = match.groups()
+        if include is not None:
+            # relative to the including file, like files.process_includes
+            _compile(
+                os.path.join(os.path.dirname(relative_path), include),
+                backup_dirs,
+                template,
+            )
+        else:
+            template.segments.append(name)
+        position = match.end()
+    _append_text(template, content[position:])
+
+
+def _append_text(template: Template, text: str):
+    if len(template.segments) % 2 == 0:
+        template.segments.append(text)
+    else:
+        template.segments[-1] += text  # text continues after an include
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,80 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on windows, only needed for shared memory dirs
+    fcntl = None
+
+
+class RWLock:
+    """Readers-writer lock, any number of readers or one writer.
+
+    Writers are preferred: once a writer waits, new readers queue behind it.
+    Not reentrant, and must not be held across an await on the event loop thread.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class FileLock:
+    """Advisory lock on a file, shared or exclusive, between processes."""
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("File locking is not supported on this platform")
+        self.path = path
+
+    @contextmanager
+    def shared(self):
+        with self._locked(fcntl.LOCK_SH):  # type: ignore
+            yield
+
+    @contextmanager
+    def exclusive(self):
+        with self._locked(fcntl.LOCK_EX):  # type: ignore
+            yield
+
+    @contextmanager
+    def _locked(self, mode: int):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            fcntl.flock(f.fileno(), mode)  # type: ignore
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)  # type: ignore
@@ -0,0 +1,131 @@
+import os
+from typing import Any, Callable
+
+from langchain_core.messages import BaseMessage
+
+MESSAGE_OVERHEAD = 4  # role and separators per chat message
+
+
+def approximate(text: str) -> int:
+    return int(len(text) / 4)
+
+
+class TokenCounter:
+    """Counts tokens for one model.
+
+    `tokenizer` selects how:
+    - "" estimates from the text length, scaled by the usage the provider
+      reported for earlier calls (see `calibrate`)
+    - "tiktoken:<encoding or model name>" uses tiktoken
+    - a path to a tokenizer.json file uses the Hugging Face tokenizers library
+    Falls back to the estimate when the library is not installed.
+    """
+
+    def __init__(self, tokenizer: str = ""):
+        self.tokenizer = tokenizer
+        self.scale = 1.0
+        self._encode = _load_tokenizer(tokenizer) if tokenizer else None
+
+    @property
+    def exact(self) -> bool:
+        return self._encode is not None
+
+    def count(self, text: str) -> int:
+        return self.scaled(self.count_unscaled(text))
+
+    def count_unscaled(self, text: str) -> int:
+        """Count before calibration, stays valid when the scale changes."""
+        if self._encode:
+            return len(self._encode(text))
+        return approximate(text)
+
+    def scaled(self, count: int) -> int:
+        return count if self.exact else round(count * self.scale)
+
+    def count_message(self, message: BaseMessage) -> int:
+        return self.count(_text(message.content)) + MESSAGE_OVERHEAD
+
+    def calibrate(self, counted: int, reported: int):
+        """Move estimates towards the input tokens the provider reported for a prompt counted as `counted`."""
+        if self.exact or counted <= 0 or reported <= 0:
+            return
+        ratio = reported / (counted / self.scale)
+        self.scale = 0.8 * self.scale + 0.2 * ratio
+
+
+class HistoryTokens:
+    """Token total of a message list, counting only messages added or changed since the last call.
+
+    Unscaled counts are memoised per message object and its content length, so
+    calibration only rescales the total. Messages are appended to in place and
+    the list itself is replaced when history is compacted.
+    """
+
+    def __init__(self, counter: TokenCounter):
+        self.counter = counter
+        self._counts: dict[int, tuple[BaseMessage, int, int]] = {}
+        self.total = 0
+
+    def update(self, messages: list[BaseMessage]) -> int:
+        counts = {}
+        unscaled = 0
+        for message in messages:
+            key = id(message)
+            length = len(message.content)
+            cached = self._counts.get(key)
+            if cached and cached[0] is message and cached[1] == length:
+                counts[key] = cached
+            else:
+                counts[key] = (
+                    message,
+                    length,
+                    self.counter.count_unscaled(_text(message.content)),
+                )
+            unscaled += counts[key][2]
+        self._counts = counts
+        self.total = self.counter.scaled(unscaled) + MESSAGE_OVERHEAD * len(messages)
+        return self.total
+
+    def count(self, message: BaseMessage) -> int:
+        cached = self._counts.get(id(message))
+        if cached and cached[0] is message and cached[1] == len(message.content):
+            return self.counter.scaled(cached[2]) + MESSAGE_OVERHEAD
+        return self.counter.count_message(message)
+
+
+def usage_of(chunk: Any) -> tuple[int, int]:
+    """Input and output tokens a streamed chunk reports, (0, 0) if none."""
+    usage = getattr(chunk, "usage_metadata", None) or {}
+    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    # multimodal content, only text parts count
+    return "".join(
+        part if isinstance(part, str) else str(part.get("text", ""))
+        for part in content
+    )
+
+
+def _load_tokenizer(tokenizer: str) -> Callable[[str], list] | None:
+    try:
+        if tokenizer.startswith("tiktoken:"):
+            import tiktoken
+
+            name = tokenizer.split(":", 1)[1]
+            try:
+                encoding = tiktoken.get_encoding(name)
+            except ValueError:
+                encoding = tiktoken.encoding_for_model(name)
+            return lambda text: encoding.encode(text, disallowed_special=())
+        if os.path.isfile(tokenizer):
+            from tokenizers import Tokenizer
+
+            loaded = Tokenizer.from_file(tokenizer)
+            return lambda text: loaded.encode(text, add_special_tokens=False).ids
+        print(f"Tokenizer '{tokenizer}' not found, estimating token counts")
+    except ImportError as e:
+        print(f"Tokenizer '{tokenizer}' needs {e.name}, estimating token counts")
+    return None
@@ -45,7 +45,7 @@ class Knowledge(Tool):
 
     async def mem_search(self, question: str):
         db = await memory.Memory.get(self.agent)
-        docs = await db.search_similarity_threshold(query=question, limit=5, threshold=0.5)
+        docs = await db.search_hybrid(query=question, limit=5, threshold=0.5)
         text = memory.Memory.format_docs_plain(docs)
         return "\n\n".join(text)
 
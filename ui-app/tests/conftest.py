@@ -0,0 +1,55 @@
+import math
+import os
+import sys
+import uuid
+
+import pytest
+
+# modules import each other as python.helpers.*, relative to ui-app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import InMemoryByteStore
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+
+def make_embedder() -> CacheBackedEmbeddings:
+    return CacheBackedEmbeddings.from_bytes_store(
+        DeterministicFakeEmbedding(size=16), InMemoryByteStore(), namespace="test"
+    )
+
+
+def make_doc(text: str, area: str = "main", **metadata) -> Document:
+    return Document(text, metadata={"id": str(uuid.uuid4()), "area": area, **metadata})
+
+
+def direction(angle: float) -> list[float]:
+    # unit vectors in the first plane, cosine between two is cos of the angle difference
+    return [math.cos(angle), math.sin(angle)] + [0.0] * 14
+
+
+def make_db(db_dir: str, shared: bool = False):
+    from python.helpers.memory import MemoryDb
+
+    db = MemoryDb(make_embedder(), db_dir, shared=shared)
+    db.load(None)
+    return db
+
+
+def insert(db, docs):
+    return db.insert(docs, db.embed_documents([doc.page_content for doc in docs]))
+
+
+def stored_texts(db) -> set[str]:
+    with db.reading():
+        return {
+            shard.docstore.get(id).page_content
+            for shard in db.shards.values()
+            for id in shard.index_to_docstore_id.values()
+        }
+
+
+@pytest.fixture
+def db_dir(tmp_path) -> str:
+    return str(tmp_path / "memory")
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agent import AgentConfig, AgentContext
+from python.helpers import history
+
+
+@pytest.fixture
+def agent():
+    config = AgentConfig(
+        chat_model=None,  # type: ignore
+        utility_model=None,  # type: ignore
+        embeddings_model=None,  # type: ignore
+        history_soft_tokens=600,
+        history_hard_tokens=1000,
+        msgs_keep_start=2,
+        msgs_keep_end=4,
+    )
+    context = AgentContext(config)
+    agent = context.agent0
+    agent.summarized = []
+
+    async def summarize_messages(text: str) -> str:
+        agent.summarized.append(text)
+        return f"summary {len(agent.summarized)}"
+
+    agent.summarize_messages = summarize_messages
+    yield agent
+    AgentContext.remove(context.id)
+
+
+def messages(first: int, count: int) -> list:
+    # about 100 tokens each, human and ai alternating
+    return [
+        (HumanMessage if i % 2 == 0 else AIMessage)(content=f"msg{i} " + "x" * 400)
+        for i in range(first, first + count)
+    ]
+
+
+def test_limit_history_summarises_the_middle_and_keeps_both_ends(agent):
+    agent.history = messages(0, 20)
+    original = list(agent.history)
+
+    asyncio.run(agent.limit_history())
+
+    # the first two, the summary, and the last messages from the human one before the last 4
+    summary = agent.history_summary.message
+    assert agent.history == [*original[:2], summary, *original[15:]]
+    assert isinstance(summary, HumanMessage)
+    assert summary.content == "summary 1"
+    assert agent.history_summary.parts == [(0, "summary 1")]
+    assert agent.summarized == [agent.concat_messages(original[2:15])]
+    assert agent.history_tokens.update(agent.history) <= 1000
+
+
+def test_history_under_the_hard_limit_is_left_alone(agent):
+    agent.history = messages(0, 6)
+    original = list(agent.history)
+
+    asyncio.run(agent.limit_history())
+
+    assert agent.history == original
+    assert agent.summarized == []
+
+
+def test_repeated_compactions_merge_summaries_into_the_next_level(agent):
+    agent.history = messages(0, 10)
+    for round in range(history.SUMMARY_FANOUT):
+        assert asyncio.run(agent.compact_history())
+        agent.history += messages(100 + 10 * round, 6)
+
+    # four level 0 summaries were merged into one level 1 part
+    assert agent.summarized[-1] == "\n\n".join(
+        f"summary {i}" for i in range(1, history.SUMMARY_FANOUT + 1)
+    )
+    merged = f"summary {history.SUMMARY_FANOUT + 1}"
+    assert agent.history_summary.parts == [(1, merged)]
+
+    # still one summary message, right after the kept first messages
+    summaries = [m for m in agent.history if m.content.startswith("summary")]
+    assert summaries == [agent.history_summary.message]
+    assert agent.history.index(summaries[0]) == 2
+    assert summaries[0].content == merged
+
+    # the summary is followed by an ai message, so turns keep alternating
+    assert agent.history[3].type == "ai"
+
+
+def test_too_few_messages_are_not_compacted(agent):
+    agent.history = messages(0, 7)
+    assert not asyncio.run(agent.compact_history())
+    assert agent.history_summary.message is None
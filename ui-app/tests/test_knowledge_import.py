@@ -0,0 +1,67 @@
+from langchain_core.documents import Document
+
+from python.helpers import knowledge_import
+from python.helpers.knowledge_import import ImportJob, _diff_chunks, chunk_hash
+
+
+def _job(previous: list[str], ids: list[str], file: str = "a.txt") -> ImportJob:
+    return ImportJob(
+        file=file,
+        checksum="",
+        metadata={},
+        stat={},
+        ids=ids,
+        chunks=[chunk_hash(Document(text)) for text in previous],
+    )
+
+
+def test_unchanged_chunks_keep_their_ids():
+    job = _job(["one", "two", "three"], ["id1", "id2", "id3"])
+    docs = [Document(text) for text in ["one", "changed", "three", "added"]]
+
+    result, new_docs = _diff_chunks(job, docs)
+
+    assert result.ids == ["id1", "", "id3", ""]
+    assert result.chunks == [chunk_hash(doc) for doc in docs]
+    assert [doc.page_content for doc in new_docs] == ["changed", "added"]
+
+
+def test_repeated_chunks_reuse_each_id_once():
+    job = _job(["same", "same"], ["id1", "id2"])
+    docs = [Document("same")] * 3
+
+    result, new_docs = _diff_chunks(job, docs)
+
+    assert result.ids == ["id1", "id2", ""]
+    assert len(new_docs) == 1
+
+
+def test_import_embeds_only_new_chunks_and_fills_their_ids(monkeypatch, tmp_path):
+    chunks = {"a.txt": ["kept", "new one", "new two"], "b.txt": ["fresh"]}
+    monkeypatch.setattr(
+        knowledge_import,
+        "load_file",
+        lambda file, metadata: [Document(text) for text in chunks[file]],
+    )
+    embedded, inserted = [], []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return [[0.0] for _ in texts]
+
+    def insert(docs, vectors):
+        ids = [f"new{len(inserted) + i}" for i in range(len(docs))]
+        inserted.extend(ids)
+        return ids
+
+    results = knowledge_import.run_import(
+        None,
+        [_job(["kept", "gone"], ["old1", "old2"]), _job([], [], file="b.txt")],
+        embed,
+        insert,
+        workers=1,
+    )
+
+    assert embedded == ["new one", "new two", "fresh"]
+    assert results["a.txt"].ids == ["old1", "new0", "new1"]
+    assert results["b.txt"].ids == ["new2"]
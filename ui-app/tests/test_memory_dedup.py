@@ -0,0 +1,68 @@
+import math
+
+from conftest import direction, make_db, make_doc, stored_texts
+
+
+def test_exact_copy_returns_the_stored_id(db_dir):
+    db = make_db(db_dir)
+    stored = make_doc("the server runs on port 8080")
+    db.insert([stored], [direction(0)])
+
+    copy = make_doc("the server runs on port 8080")
+    # a different vector still matches by content hash
+    ids = db.insert([copy], [direction(1.5)], dedup_threshold=0)
+
+    assert ids == [stored.metadata["id"]]
+    assert stored_texts(db) == {"the server runs on port 8080"}
+
+
+def test_near_duplicate_returns_the_stored_id_only_above_the_threshold(db_dir):
+    db = make_db(db_dir)
+    stored = make_doc("user prefers dark mode")
+    db.insert([stored], [direction(0)])
+
+    # relevance is (1 + cosine) / 2: about 0.99 for the near one, 0.5 for the far one
+    near, far = make_doc("user likes dark mode"), make_doc("deploys run nightly")
+    ids = db.insert(
+        [near, far], [direction(0.2), direction(math.pi / 2)], dedup_threshold=0.95
+    )
+
+    assert ids == [stored.metadata["id"], far.metadata["id"]]
+    assert stored_texts(db) == {"user prefers dark mode", "deploys run nightly"}
+
+
+def test_repeats_within_one_insert_map_to_the_first(db_dir):
+    db = make_db(db_dir)
+    first, repeat = make_doc("same fact"), make_doc("same fact")
+
+    ids = db.insert([first, repeat], [direction(0), direction(0)], dedup_threshold=0)
+
+    assert ids == [first.metadata["id"]] * 2
+    assert stored_texts(db) == {"same fact"}
+
+
+def test_knowledge_chunks_are_not_duplicates(db_dir):
+    db = make_db(db_dir)
+    db.insert([make_doc("imported fact", source="/knowledge/a.md")], [direction(0)])
+
+    memory = make_doc("imported fact")
+    ids = db.insert([memory], [direction(0)], dedup_threshold=0.95)
+
+    assert ids == [memory.metadata["id"]]
+
+
+def test_deduplicate_removes_newer_copies_and_keeps_the_oldest(db_dir):
+    db = make_db(db_dir)
+    oldest, copy, near, other = (
+        make_doc("oldest"),
+        make_doc("oldest"),
+        make_doc("near"),
+        make_doc("other"),
+    )
+    db.insert(
+        [oldest, copy, near, other],
+        [direction(0), direction(2), direction(0.1), direction(math.pi / 2)],
+    )
+
+    assert db.deduplicate(0.95) == 2
+    assert stored_texts(db) == {"oldest", "other"}
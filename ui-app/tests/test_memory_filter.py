@@ -0,0 +1,91 @@
+import pytest
+
+from python.helpers.memory_filter import Filter, MetadataColumns
+
+ROWS = [
+    {"area": "main", "priority": 1},
+    {"area": "fragments", "priority": 5},
+    {"area": "solutions", "priority": "high"},
+    {"area": "main"},
+]
+
+
+def matching(condition: str) -> list[int]:
+    mask = Filter(condition).mask(MetadataColumns.from_metadatas(ROWS))
+    return [row for row, matched in enumerate(mask) if matched]
+
+
+@pytest.mark.parametrize(
+    "condition, rows",
+    [
+        ("area == 'main'", [0, 3]),
+        ("area != 'main'", [1, 2]),
+        ("area in ['main', 'solutions']", [0, 2, 3]),
+        ("area not in ('main',)", [1, 2]),
+        ("area == 'main' and priority == 1", [0]),
+        ("area == 'fragments' or area == 'solutions'", [1, 2]),
+        ("not area == 'main'", [1, 2]),
+        ("0 < priority < 5", [0]),
+        ("priority", [0, 1, 2]),
+        ("True", [0, 1, 2, 3]),
+        ("1 == 2", []),
+    ],
+)
+def test_supported_grammar(condition, rows):
+    assert matching(condition) == rows
+
+
+@pytest.mark.parametrize(
+    "condition, rows",
+    [
+        # evaluating these on a row without the key fails, so the row does not match
+        ("priority != 2", [0, 1, 2]),
+        ("not priority == 1", [1, 2]),
+        ("area == 'main' and priority == 1", [0]),
+        # unless an earlier operand already decided the result
+        ("area == 'main' or priority == 5", [0, 1, 3]),
+        ("area != 'main' and priority == 5", [1]),
+        # comparing unorderable values fails the same way
+        ("priority > 2", [1]),
+    ],
+)
+def test_rows_missing_a_key_or_failing_a_comparison_do_not_match(condition, rows):
+    assert matching(condition) == rows
+
+
+@pytest.mark.parametrize(
+    "condition",
+    [
+        "__import__('os').system('true')",
+        "area.startswith('m')",
+        "area ==",
+        "area is None",
+        "[x for x in area]",
+    ],
+)
+def test_invalid_or_unsupported_expressions_match_nothing(condition):
+    condition_filter = Filter(condition)
+    assert matching(condition) == []
+    assert not condition_filter.matches({"area": "main"})
+    assert condition_filter.values_of("area") == set()
+
+
+def test_matches_single_metadata():
+    condition_filter = Filter("area == 'main' and priority >= 1")
+    assert condition_filter.matches({"area": "main", "priority": 3})
+    assert not condition_filter.matches({"area": "main"})
+
+
+@pytest.mark.parametrize(
+    "condition, values",
+    [
+        ("area == 'main'", {"main"}),
+        ("'main' == area", {"main"}),
+        ("area == 'main' or area in ['fragments']", {"main", "fragments"}),
+        ("area == 'main' and priority == 1", {"main"}),
+        ("area == 'main' or priority == 1", None),
+        ("area != 'main'", None),
+    ],
+)
+def test_values_of_restricts_areas_for_routing(condition, values):
+    assert Filter(condition).values_of("area") == values
@@ -0,0 +1,90 @@
+import json
+import os
+
+from conftest import make_doc
+from python.helpers.memory_journal import MemoryJournal
+
+
+class Recorder:
+    def __init__(self):
+        self.ops = []
+
+    def insert(self, docs, vectors):
+        self.ops.append(("insert", [doc.page_content for doc in docs], vectors))
+
+    def delete(self, ids):
+        self.ops.append(("delete", ids))
+
+
+def replay(journal: MemoryJournal) -> list:
+    recorder = Recorder()
+    journal.replay(recorder.insert, recorder.delete)
+    return recorder.ops
+
+
+def test_replay_applies_operations_in_order(tmp_path):
+    journal = MemoryJournal(str(tmp_path))
+    a, b = make_doc("a"), make_doc("b")
+    journal.append_insert([a, b], [[1.0, 2.0], [3.0, 4.0]])
+    journal.append_delete([a.metadata["id"]])
+
+    ops = replay(MemoryJournal(str(tmp_path)))
+    assert ops == [
+        ("insert", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]]),
+        ("delete", [a.metadata["id"]]),
+    ]
+    assert MemoryJournal(str(tmp_path)).ops == 2
+
+
+def test_torn_line_is_skipped_and_not_glued_to_the_next_record(tmp_path):
+    journal = MemoryJournal(str(tmp_path))
+    journal.append_insert([make_doc("kept")], [[1.0]])
+    with open(journal.path, "ab") as f:
+        f.write(b'{"op": "insert", "docs": [{"id": "torn"')  # crash mid-append
+
+    reopened = MemoryJournal(str(tmp_path))
+    reopened.append_delete(["x"])
+
+    assert replay(MemoryJournal(str(tmp_path))) == [
+        ("insert", ["kept"], [[1.0]]),
+        ("delete", ["x"]),
+    ]
+
+
+def test_unterminated_last_line_is_not_applied(tmp_path):
+    # another process may still be writing it
+    journal = MemoryJournal(str(tmp_path))
+    journal.append_delete(["a"])
+    with open(journal.path, "ab") as f:
+        f.write(json.dumps({"op": "delete", "ids": ["b"]}).encode())
+
+    assert [record for record, _ in MemoryJournal._read(journal.path)] == [
+        {"op": "delete", "ids": ["a"]}
+    ]
+
+
+def test_compacting_journal_is_replayed_before_the_live_one(tmp_path):
+    journal = MemoryJournal(str(tmp_path))
+    journal.append_delete(["older"])
+    os.replace(journal.path, journal.compacting_path)  # compaction interrupted
+    journal.append_delete(["newer"])
+
+    assert replay(MemoryJournal(str(tmp_path))) == [
+        ("delete", ["older"]),
+        ("delete", ["newer"]),
+    ]
+
+
+def test_replay_new_returns_only_later_operations(tmp_path):
+    reader = MemoryJournal(str(tmp_path))
+    replay(reader)
+    writer = MemoryJournal(str(tmp_path))
+    writer.append_delete(["a"])
+    writer.append_delete(["b"])
+
+    recorder = Recorder()
+    assert reader.replay_new(recorder.insert, recorder.delete)
+    assert recorder.ops == [("delete", ["a"]), ("delete", ["b"])]
+    recorder.ops.clear()
+    assert reader.replay_new(recorder.insert, recorder.delete)
+    assert recorder.ops == []
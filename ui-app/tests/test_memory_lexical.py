@@ -0,0 +1,77 @@
+import math
+
+import pytest
+
+from conftest import make_doc
+from python.helpers.memory_lexical import (
+    LexicalIndex,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+
+
+def make_index(texts: dict[str, str]) -> LexicalIndex:
+    index = LexicalIndex()
+    index.add(texts.keys(), texts.values())
+    return index
+
+
+def test_tokenize_splits_compound_identifiers():
+    assert tokenize("Ping db-01.local") == ["ping", "db-01.local", "db", "01", "local"]
+
+
+def test_bm25_score_matches_the_formula():
+    index = make_index({"a": "error timeout", "b": "disk full", "c": "error error"})
+    n, containing, average = 3, 2, 2.0
+    idf = math.log(1 + (n - containing + 0.5) / (containing + 0.5))
+
+    def score(count: int, length: int) -> float:
+        norm = LexicalIndex.K1 * (1 - LexicalIndex.B + LexicalIndex.B * length / average)
+        return idf * count * (LexicalIndex.K1 + 1) / (count + norm)
+
+    assert index.search("error") == [
+        ("c", pytest.approx(score(2, 2))),
+        ("a", pytest.approx(score(1, 2))),
+    ]
+
+
+def test_rare_terms_and_shorter_documents_rank_first():
+    index = make_index(
+        {
+            "common": "server restarted",
+            "rare": "raised E1042",
+            "other": "server stopped",
+        }
+    )
+    # "server" is in two documents, "E1042" only in one
+    assert index.search("server E1042")[0][0] == "rare"
+
+    index = make_index({"short": "E1042 raised", "long": "E1042 " + "padding " * 20})
+    assert [id for id, _ in index.search("E1042")] == ["short", "long"]
+
+
+def test_stopwords_are_ignored_and_min_match_drops_weak_hits():
+    index = make_index({"a": "the kernel panicked", "b": "the disk is full"})
+    assert index.search("the is") == []
+    assert [id for id, _ in index.search("kernel disk unknownterm")] == ["a", "b"]
+    assert index.search("kernel disk unknownterm", min_match=0.5) == []
+
+
+def test_removed_and_replaced_documents_are_no_longer_found():
+    index = make_index({"a": "alpha", "b": "beta"})
+    index.remove(["a"], ["alpha"])
+    index.add(["b"], ["gamma"])
+    assert len(index) == 1
+    assert index.search("alpha beta") == []
+    assert [id for id, _ in index.search("gamma")] == ["b"]
+
+
+def test_fusion_ranks_documents_found_by_both_searches_first():
+    a, b, c, d = (make_doc(text) for text in "abcd")
+    vector = [a, b, c]
+    lexical = [c, d, b]
+
+    fused = reciprocal_rank_fusion([vector, lexical], limit=3)
+
+    # b and c appear in both lists, c ranks higher on average
+    assert [doc.page_content for doc in fused] == ["c", "b", "a"]
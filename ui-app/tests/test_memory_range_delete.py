@@ -0,0 +1,45 @@
+import math
+
+from conftest import direction, make_db, make_doc, stored_texts
+
+
+def test_delete_matching_removes_only_vectors_within_the_threshold(db_dir):
+    db = make_db(db_dir)
+    # relevance (1 + cosine) / 2 to direction(0): 1.0, 0.99, 0.85, 0.5, 0.0
+    angles = {
+        "same": 0,
+        "close": 0.2,
+        "edge": 0.8,
+        "orthogonal": math.pi / 2,
+        "opposite": math.pi,
+    }
+    docs = [make_doc(text) for text in angles]
+    db.insert(docs, [direction(angle) for angle in angles.values()])
+
+    removed = db.delete_matching(direction(0), 0.9)
+
+    assert {doc.page_content for doc in removed} == {"same", "close"}
+    assert stored_texts(db) == {"edge", "orthogonal", "opposite"}
+
+
+def test_delete_matching_respects_the_filter_and_other_areas(db_dir):
+    db = make_db(db_dir)
+    docs = [
+        make_doc("main match"),
+        make_doc("fragment match", area="fragments"),
+        make_doc("main miss"),
+    ]
+    db.insert(docs, [direction(0), direction(0.1), direction(math.pi / 2)])
+
+    removed = db.delete_matching(direction(0), 0.9, "area == 'main'")
+
+    assert [doc.page_content for doc in removed] == ["main match"]
+    assert stored_texts(db) == {"fragment match", "main miss"}
+
+
+def test_deleted_vectors_are_gone_after_reopening(db_dir):
+    db = make_db(db_dir)
+    db.insert([make_doc("drop"), make_doc("keep")], [direction(0), direction(math.pi)])
+    db.delete_matching(direction(0), 0.9)
+
+    assert stored_texts(make_db(db_dir)) == {"keep"}
@@ -0,0 +1,58 @@
+import math
+
+import numpy as np
+
+from conftest import direction, make_doc
+from python.helpers.memory_recall import approximate_tokens, select
+
+
+def candidate(text: str, angle: float, tokens: int = 10):
+    # pad to the wanted token estimate, about 4 characters per token
+    doc = make_doc(text.ljust(tokens * 4))
+    return doc, 0.0, np.array(direction(angle), dtype=np.float32)
+
+
+def contents(recall) -> list[str]:
+    return [doc.page_content.strip() for doc in recall.docs]
+
+
+QUERY = np.array(direction(0), dtype=np.float32)
+
+
+def test_plain_relevance_order_without_diversity_or_budget():
+    candidates = [candidate("b", 0.3), candidate("a", 0.1), candidate("c", 0.5)]
+    assert contents(select(candidates, QUERY, limit=2)) == ["a", "b"]
+
+
+def test_mmr_skips_near_copies_of_selected_results():
+    candidates = [
+        candidate("best", 0.1),
+        candidate("copy of best", 0.11),
+        candidate("different", -0.6),
+    ]
+    recall = select(candidates, QUERY, limit=2, mmr_lambda=0.5)
+    assert contents(recall) == ["best", "different"]
+
+
+def test_selection_stays_within_the_token_budget():
+    candidates = [
+        candidate("long", 0.1, tokens=80),
+        candidate("short", 0.2, tokens=30),
+        candidate("shorter", 0.3, tokens=20),
+        candidate("far", math.pi / 2, tokens=10),
+    ]
+
+    recall = select(candidates, QUERY, limit=3, token_budget=60)
+
+    assert contents(recall) == ["short", "shorter", "far"]
+    assert recall.tokens == sum(
+        approximate_tokens(doc.page_content) for doc in recall.docs
+    )
+    assert recall.tokens <= 60
+    # the plain top three would have cost 80 + 30 + 20
+    assert recall.tokens_saved == 130 - recall.tokens
+
+
+def test_nothing_fits_a_budget_smaller_than_every_candidate():
+    recall = select([candidate("a", 0, tokens=50)], QUERY, limit=1, token_budget=10)
+    assert recall.docs == [] and recall.tokens == 0
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from conftest import insert, make_db, make_doc, stored_texts
+from python.helpers.memory_filter import MetadataColumns
+from python.helpers.memory_retention import LFU, OLDEST, AccessStats, expired
+
+DAY = 86400
+NOW = datetime(2024, 6, 30).timestamp()
+
+
+def timestamp(days_ago: float) -> str:
+    return datetime.fromtimestamp(NOW - days_ago * DAY).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def columns(*days_ago: float) -> MetadataColumns:
+    return MetadataColumns.from_metadatas(
+        [{"timestamp": timestamp(days)} for days in days_ago]
+    )
+
+
+def test_max_age_removes_old_rows_but_not_excluded_ones():
+    rows = columns(40, 10, 50, 1)
+    stats = AccessStats(4, now=NOW)
+    exclude = np.array([False, False, True, False])
+
+    assert expired({"max_age_days": 30}, rows, stats, NOW).tolist() == [0, 2]
+    assert expired({"max_age_days": 30}, rows, stats, NOW, exclude).tolist() == [0]
+
+
+def test_max_idle_uses_the_last_recall():
+    stats = AccessStats(3, now=NOW - 20 * DAY)
+    stats.touch(np.array([1]), now=NOW - DAY)
+
+    assert expired({"max_idle_days": 7}, columns(0, 0, 0), stats, NOW).tolist() == [0, 2]
+
+
+def test_max_items_evicts_in_the_policy_order_and_skips_excluded_rows():
+    rows = columns(3, 1, 4, 2)
+    stats = AccessStats(4, now=NOW)
+    stats.recalls[:] = [5, 0, 2, 1]
+    exclude = np.array([False, False, True, False])
+
+    assert expired({"max_items": 2, "evict": OLDEST}, rows, stats, NOW).tolist() == [0, 2]
+    assert expired({"max_items": 2, "evict": LFU}, rows, stats, NOW).tolist() == [1, 3]
+    # the excluded row neither goes nor counts towards the limit
+    policy = {"max_items": 2, "evict": OLDEST}
+    assert expired(policy, rows, stats, NOW, exclude).tolist() == [0]
+
+
+def test_sweep_spares_knowledge_chunks(db_dir):
+    db = make_db(db_dir)
+    now = datetime.now()
+    old = (now - timedelta(days=100)).strftime("%Y-%m-%d %H:%M:%S")
+    insert(
+        db,
+        [
+            make_doc("old memory", timestamp=old),
+            make_doc("old knowledge", timestamp=old, source="/knowledge/a.md"),
+            make_doc("new memory", timestamp=now.strftime("%Y-%m-%d %H:%M:%S")),
+        ],
+    )
+
+    assert db.sweep({"main": {"max_age_days": 30}}) == 1
+    assert stored_texts(db) == {"old knowledge", "new memory"}
@@ -0,0 +1,81 @@
+import multiprocessing
+
+from conftest import insert, make_db, make_doc, stored_texts
+
+
+def test_instances_catch_up_on_each_others_writes(db_dir):
+    a = make_db(db_dir, shared=True)
+    b = make_db(db_dir, shared=True)
+
+    first = make_doc("from a")
+    insert(a, [first])
+    assert stored_texts(b) == {"from a"}
+
+    insert(b, [make_doc("from b", area="fragments")])
+    b.delete([first.metadata["id"]])
+    assert stored_texts(a) == {"from b"}
+
+
+def test_catch_up_reloads_the_snapshot_after_another_compaction(db_dir):
+    a = make_db(db_dir, shared=True)
+    b = make_db(db_dir, shared=True)
+    insert(a, [make_doc("one")])
+    assert stored_texts(b) == {"one"}
+
+    # rotates the journal b was reading, b has to reopen the shard
+    a.compact(wait=True)
+    insert(a, [make_doc("two")])
+    assert stored_texts(b) == {"one", "two"}
+
+
+def _insert_and_compact(db_dir: str, texts: list[str]):
+    db = make_db(db_dir, shared=True)
+    for text in texts:
+        insert(db, [make_doc(text)])
+    db.compact(wait=True)
+
+
+def _run_process(target, *args):
+    process = multiprocessing.get_context("spawn").Process(target=target, args=args)
+    process.start()
+    process.join(120)
+    assert process.exitcode == 0
+
+
+def test_compaction_is_detected_when_the_journal_was_empty_at_open(db_dir):
+    _run_process(_insert_and_compact, db_dir, ["seed"])
+
+    a = make_db(db_dir, shared=True)  # no live journal to remember
+    _run_process(_insert_and_compact, db_dir, ["x1", "x2"])
+    assert stored_texts(a) == {"seed", "x1", "x2"}
+
+    # a snapshot of a must not drop what b compacted
+    insert(a, [make_doc("from a")])
+    a.compact(wait=True)
+    assert stored_texts(make_db(db_dir)) == {"seed", "x1", "x2", "from a"}
+
+
+def test_lazily_read_index_matches_the_opened_snapshot(db_dir):
+    b = make_db(db_dir, shared=True)
+    insert(b, [make_doc("seed")])
+    b.compact(wait=True)
+
+    a = make_db(db_dir, shared=True)
+    insert(b, [make_doc("x1")])
+    b.compact(wait=True)
+    # a opened the shard before the second snapshot and has not read its index yet
+    shard = a.shards["main"]
+    assert shard.index.ntotal == len(shard.index_to_docstore_id)
+
+
+def _insert_in_process(db_dir: str, text: str):
+    insert(make_db(db_dir, shared=True), [make_doc(text)])
+
+
+def test_writes_of_another_process_are_seen(db_dir):
+    db = make_db(db_dir, shared=True)
+    insert(db, [make_doc("parent")])
+
+    _run_process(_insert_in_process, db_dir, "child")
+
+    assert stored_texts(db) == {"parent", "child"}
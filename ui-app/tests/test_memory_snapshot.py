@@ -0,0 +1,88 @@
+import os
+
+from conftest import insert, make_db, make_doc, stored_texts
+from python.helpers.memory import MyFaiss, _recover_snapshot, _swap_snapshot
+from python.helpers.memory_journal import MemoryJournal
+
+
+def _write(folder: str, content: str):
+    os.makedirs(folder)
+    with open(os.path.join(folder, "data"), "w") as f:
+        f.write(content)
+
+
+def _read(folder: str) -> str:
+    with open(os.path.join(folder, "data")) as f:
+        return f.read()
+
+
+def test_swap_replaces_the_snapshot_and_removes_the_old_one(tmp_path):
+    current, new = str(tmp_path / "snapshot"), str(tmp_path / "snapshot.tmp")
+    _write(current, "old")
+    _write(new, "new")
+
+    _swap_snapshot(current, new)
+
+    assert _read(current) == "new"
+    assert not os.path.exists(new)
+    assert not os.path.exists(current + ".old")
+
+
+def test_recover_restores_the_old_snapshot_after_a_crash_mid_swap(tmp_path):
+    current = str(tmp_path / "snapshot")
+    _write(current + ".old", "old")  # renamed away, new one not moved in yet
+
+    assert _recover_snapshot(current) == current
+    assert _read(current) == "old"
+    assert _recover_snapshot(str(tmp_path / "missing")) is None
+
+
+def _shard_dir(db) -> str:
+    return os.path.join(db.db_dir, "shards", "main")
+
+
+def test_reopen_after_crash_mid_swap_keeps_every_memory(db_dir):
+    db = make_db(db_dir)
+    insert(db, [make_doc("first"), make_doc("second")])
+    db.compact(wait=True)
+    insert(db, [make_doc("journaled")])
+
+    snapshot = os.path.join(_shard_dir(db), MyFaiss.SNAPSHOT_DIR)
+    os.rename(snapshot, snapshot + ".old")
+
+    assert stored_texts(make_db(db_dir)) == {"first", "second", "journaled"}
+
+
+def test_reopen_after_crash_mid_compaction_keeps_every_memory(db_dir):
+    db = make_db(db_dir)
+    insert(db, [make_doc("snapshotted")])
+    db.compact(wait=True)
+    insert(db, [make_doc("rotated")])
+
+    # the live journal was rotated and the new snapshot only partly written
+    folder = _shard_dir(db)
+    os.replace(
+        os.path.join(folder, MemoryJournal.FILE),
+        os.path.join(folder, MemoryJournal.COMPACTING),
+    )
+    os.makedirs(os.path.join(folder, MyFaiss.SNAPSHOT_DIR + ".tmp"))
+    insert(db, [make_doc("after")])
+
+    reopened = make_db(db_dir)
+    assert stored_texts(reopened) == {"snapshotted", "rotated", "after"}
+
+    reopened.compact(wait=True)
+    assert not os.path.exists(os.path.join(folder, MemoryJournal.COMPACTING))
+    assert stored_texts(make_db(db_dir)) == {"snapshotted", "rotated", "after"}
+
+
+def test_deletes_survive_compaction_and_reopen(db_dir):
+    db = make_db(db_dir)
+    keep, drop = make_doc("keep"), make_doc("drop")
+    insert(db, [keep, drop])
+    db.delete([drop.metadata["id"]])
+    db.compact(wait=True)
+
+    reopened = make_db(db_dir)
+    assert stored_texts(reopened) == {"keep"}
+    assert reopened.get_by_ids([keep.metadata["id"]])[0].page_content == "keep"
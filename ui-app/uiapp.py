@@ -17,6 +17,8 @@ from werkzeug.serving import WSGIRequestHandler
 from pathlib import Path
 
 from python.helpers import persist_chat
+from python.helpers.defer import DeferredTask
+from python.helpers.memory import Memory
 
 app = Flask("app", static_folder=get_abs_path("./web"), static_url_path="/")
 app.config["JSON_SORT_KEYS"] = False
@@ -288,6 +290,9 @@ async def poll():
                     "log_version": len(context.log.updates),
                     "log_progress": context.log.progress,
                     "paused": context.paused,
+                    "knowledge": Memory.preload_status(),
+                    "query_cache": Memory.query_cache_status(),
+                    "prompt_cache": context.prompt_cache.stats(),
             }
     except Exception as e:
         response = {
@@ -307,6 +312,8 @@ def run():
     load_dotenv()
     host = os.environ.get("WEB_UI_HOST", "0.0.0.0")
     port = int(os.environ.get("WEB_UI_PORT", 0)) or None
+    # start indexing knowledge before the first message, chats search what is ready meanwhile
+    DeferredTask(Memory.get, get_context("").agent0)
     app.run(port = port, host=host)
     #app.run(request.handler=NoRequestLoggingWSGIRequestHandler, port=port)
 
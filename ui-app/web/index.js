@@ -204,7 +204,7 @@ async function poll() {
                 }
             }
 
-            updateProgress(response.log_progress)
+            updateProgress(response.log_progress || knowledgeProgress(response.knowledge))
 
             //set ui model vars from backend
             const inputAD = Alpine.$data(inputSection);
@@ -229,6 +229,14 @@ async function poll() {
     return updated
 }
 
+function knowledgeProgress(knowledge) {
+    for (const [subdir, status] of Object.entries(knowledge || {})) {
+        if (status.state == "scanning") return `Scanning knowledge of ${subdir}...`
+        if (status.state == "importing") return `Indexing knowledge of ${subdir}: ${status.files_done}/${status.files_total} files`
+    }
+    return ""
+}
+
 function updateProgress(progress) {
     if (!progress) progress = "Waiting for input"
 